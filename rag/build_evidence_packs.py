@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Offline job: precompute an evidence pack for every episode (or an ep_id file)
+into one memory-mapped file read by summarize.py --packs.
+
+A pack holds the KG facts get_structured_data_batch() returns plus the episode's
+note ids ordered by ts and up to --max-notes snippets spread evenly over
+the episode. Rebuild after each data refresh.
+
+  python rag/build_evidence_packs.py --out packs/evidence.epk
+  python rag/build_evidence_packs.py --episodes-file episodes_dev.txt --out packs/dev.epk
+"""
+import os
+import time
+import argparse
+from itertools import groupby
+import psycopg2
+from neo4j import GraphDatabase
+from summarize import PG_DSN, NEO_URI, NEO_AUTH, MAX_FACTS, KG_BATCH, fetch_structured_batch, sm
+from evidence_pack import PackWriter
+
+
+def read_ep_ids(path):
+    with open(path) as f:
+        return [ln.strip() for ln in f if ln.strip()]
+
+
+def spread(items, k):
+    """At most k items, evenly spaced and in order (first and last included)."""
+    if len(items) <= k:
+        return items
+    if k <= 1:
+        return items[:k]
+    step = (len(items) - 1) / (k - 1)
+    return [items[round(i * step)] for i in range(k)]
+
+
+def episode_ids(conn, eps):
+    if eps is not None:
+        return eps
+    with conn.cursor() as cur:
+        cur.execute("SELECT ep_id FROM coh.episodes")
+        return [r[0] for r in cur.fetchall()]
+
+
+def note_groups(conn, source_view, snippet_chars, eps):
+    """(ep_id, [(note_id, ts, section, snippet), ...]) ordered by ts."""
+    sql = f"""
+        SELECT ep_id, note_id, ts, section, LEFT(text, %s)
+        FROM {source_view}
+        WHERE text IS NOT NULL
+    """
+    params = [snippet_chars]
+    if eps is not None:
+        sql += " AND ep_id = ANY(%s) "
+        params.append(eps)
+    sql += " ORDER BY ep_id, ts, note_id "
+    with conn.cursor(name="pack_notes") as cur:
+        cur.itersize = 20000
+        cur.execute(sql, params)
+        for ep, rows in groupby(cur, key=lambda r: r[0]):
+            yield ep, [r[1:] for r in rows]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default="packs/evidence.epk", help="Pack file to write")
+    ap.add_argument("--dsn", default=PG_DSN, help="Postgres DSN")
+    ap.add_argument("--source-view", default="coh.episode_notes")
+    ap.add_argument("--episodes-file", default=None, help="Only these ep_ids (one per line)")
+    ap.add_argument("--max-notes", type=int, default=12, help="Snippets kept per episode")
+    ap.add_argument("--snippet-chars", type=int, default=1200, help="Characters kept per snippet")
+    ap.add_argument("--max-facts", type=int, default=MAX_FACTS, help="KG facts kept per episode and type")
+    sm.add_metrics_args(ap)
+    args = ap.parse_args()
+    sm.configure_from_args(args)
+
+    eps = read_ep_ids(args.episodes_file) if args.episodes_file else None
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    m = sm.get("evidence_packs")
+
+    conn = psycopg2.connect(args.dsn)
+    todo = set(episode_ids(conn, eps))
+    total = len(todo)
+    conn.commit()
+    print(f"[i] Building packs for {total} episode(s) → {args.out}")
+
+    meta = {"created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "source_view": args.source_view,
+            "max_notes": args.max_notes, "snippet_chars": args.snippet_chars, "max_facts": args.max_facts}
+    with GraphDatabase.driver(NEO_URI, auth=NEO_AUTH) as driver, driver.session() as session, \
+            PackWriter(args.out, meta) as w, sm.profile():
+
+        pending = []
+
+        def flush():
+            # one batched KG fetch per KG_BATCH episodes
+            with m.batch("kg"):
+                facts = fetch_structured_batch(session, [ep for ep, _ in pending], args.max_facts)
+            for ep_id, notes in pending:
+                w.add(ep_id, {
+                    "ep_id": ep_id,
+                    "facts": facts[ep_id],
+                    "note_ids": [n[0] for n in notes],
+                    "notes": [{"id": nid, "ts": str(ts), "section": sec, "text": txt}
+                              for nid, ts, sec, txt in spread(notes, args.max_notes)],
+                })
+            m.add_rows(len(pending))
+            m.report(total, every=10)
+            pending.clear()
+
+        def add(ep_id, notes):
+            pending.append((ep_id, notes))
+            if len(pending) >= KG_BATCH:
+                flush()
+
+        for ep_id, notes in note_groups(conn, args.source_view, args.snippet_chars, eps):
+            if ep_id in todo:
+                todo.discard(ep_id)
+                add(ep_id, notes)
+        m.roundtrip("postgres")
+        for ep_id in sorted(todo):   # episodes without notes still get their KG facts
+            add(ep_id, [])
+        if pending:
+            flush()
+    conn.close()
+    m.report(total)
+    print(f"[done] {m.rows} pack(s) in {m.elapsed():.1f}s → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
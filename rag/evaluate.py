@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 import os
+import argparse
 import psycopg2
 import evaluate
-from summarize import get_structured_data, get_unstructured_data, format_prompt, generate
-from qdrant_client import QdrantClient
+from summarize import (get_structured_data_batch, get_unstructured_data, open_vector_store, summarize_episode,
+                       sm, vs, VECTOR_BACKEND)
 from sentence_transformers import SentenceTransformer
 
 # --- CONFIG ---
@@ -17,21 +18,30 @@ GOLD_SUMMARIES = {
 }
 
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backend", default=VECTOR_BACKEND, choices=vs.BACKENDS, help="Vector store for note retrieval")
+    sm.add_metrics_args(ap)
+    args = ap.parse_args()
+    sm.configure_from_args(args)
+
     # --- Initialize clients ---
     model = SentenceTransformer('intfloat/e5-base-v2')
-    qdrant_client = QdrantClient(os.environ.get("QDRANT_URL", "http://localhost:6333"))
+    store = open_vector_store(backend=args.backend)
 
     # --- Get episode IDs from the gold standard set ---
     episode_ids = list(GOLD_SUMMARIES.keys())
 
     # --- Generate summaries ---
     generated_summaries = []
-    for ep_id in episode_ids:
-        structured_data = get_structured_data(ep_id)
-        unstructured_data = get_unstructured_data(ep_id, model, qdrant_client)
-        prompt = format_prompt(ep_id, structured_data, unstructured_data)
-        summary = generate(prompt)
-        generated_summaries.append(summary)
+    with sm.profile():
+        structured = get_structured_data_batch(episode_ids)   # a few round trips for the whole set
+        for ep_id in episode_ids:
+            structured_data = structured[ep_id]
+            unstructured_data = get_unstructured_data(ep_id, model, store)
+            summary = "".join(summarize_episode(ep_id, structured_data, unstructured_data))
+            generated_summaries.append(summary)
+    sm.get("retrieval").report()
+    sm.get("generation").report()
 
     # --- Evaluate ---
     rouge = evaluate.load('rouge')
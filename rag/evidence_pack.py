@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Episode evidence packs: one memory-mapped file holding, per ep_id, the KG
+facts and the ordered note ids/snippets a summary prompt needs, so a pack
+can be served without touching Neo4j, Qdrant or Postgres.
+
+File layout (little-endian):
+
+  header  MAGIC "EPK1" | u32 version | u64 n_records | u64 index_offset | u64 index_len
+  records msgpack blobs, back to back
+  index   msgpack {"meta": {...}, "index": {ep_id: [offset, length]}}
+
+Opening a pack reads the offset table once; get(ep_id) is then one dict
+lookup plus one slice of the mmap.
+"""
+
+import os
+import mmap
+import struct
+import msgpack
+
+MAGIC = b"EPK1"
+VERSION = 1
+HEADER = struct.Struct("<4sIQQQ")
+
+
+def _default(o):
+    # neo4j temporal values, Decimals, ... → strings
+    return str(o)
+
+
+class PackWriter:
+    def __init__(self, path, meta=None):
+        self.path = path
+        self.meta = dict(meta or {})
+        self.index = {}
+        self._tmp = f"{path}.tmp"
+        self._f = open(self._tmp, "wb")
+        self._f.write(b"\0" * HEADER.size)
+
+    def add(self, ep_id, record):
+        blob = msgpack.packb(record, default=_default, use_bin_type=True)
+        self.index[ep_id] = [self._f.tell(), len(blob)]
+        self._f.write(blob)
+
+    def close(self):
+        index_offset = self._f.tell()
+        blob = msgpack.packb({"meta": self.meta, "index": self.index}, use_bin_type=True)
+        self._f.write(blob)
+        self._f.seek(0)
+        self._f.write(HEADER.pack(MAGIC, VERSION, len(self.index), index_offset, len(blob)))
+        self._f.close()
+        os.replace(self._tmp, self.path)   # readers never see a half-written pack
+
+    def abort(self):
+        """Discard the temporary file; an existing pack at `path` is left alone."""
+        self._f.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class PackReader:
+    def __init__(self, path):
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n, off, length = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not an evidence pack (magic={magic!r}, version={version})")
+        toc = msgpack.unpackb(self._mm[off:off + length], raw=False)
+        self.meta = toc["meta"]
+        self._index = toc["index"]
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, ep_id):
+        return ep_id in self._index
+
+    def keys(self):
+        return self._index.keys()
+
+    def get(self, ep_id):
+        """The pack for `ep_id`, or None."""
+        loc = self._index.get(ep_id)
+        if loc is None:
+            return None
+        off, length = loc
+        return msgpack.unpackb(self._mm[off:off + length], raw=False)
+
+    def close(self):
+        self._mm.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
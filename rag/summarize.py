@@ -1,20 +1,53 @@
 #!/usr/bin/env python3
 import os
+import sys
+import time
+import argparse
+from bisect import bisect_right
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
 import psycopg2
 from neo4j import GraphDatabase, basic_auth
-from qdrant_client import QdrantClient
 from sentence_transformers import SentenceTransformer
 import openai
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import stage_metrics as sm
+import vector_store as vs
+from evidence_pack import PackReader
+
 # --- CONFIG ---
 PG_DSN = os.environ.get("PG_DSN", "host=localhost dbname=synthea user=mimic password=strong_password")
 NEO_URI = os.environ.get("NEO_URI", "bolt://localhost:7687")
 NEO_AUTH = basic_auth(os.environ.get("NEO4J_USER", "neo4j"), os.environ.get("NEO4J_PASSWORD", "neo4j_password"))
 QDRANT_URL = os.environ.get("QDRANT_URL", "http://localhost:6333")
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "qdrant")   # or "local" (embedded store, no service)
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "openai")   # or "stub" (local, deterministic, no API key)
 
 # --- LLM ---
-def generate(prompt, max_tokens=700, temperature=0.2):
+def _stub_stream(prompt, max_tokens):
+    """Local stand-in LLM for tests and benchmarks. STUB_LLM_DELAY adds a
+    fixed latency (seconds) per call before the first token."""
+    delay = float(os.environ.get("STUB_LLM_DELAY", "0"))
+    if delay:
+        time.sleep(delay)
+    text = (f"[stub] {len(prompt)} prompt chars, {prompt.count('--- Note')} notes, "
+            f"{prompt.count('--- Part')} partial summaries.")
+    if "1. Presenting Problem" in prompt:
+        text += "".join(f"\n{s}: Information not available." for s in
+                        ("1. Presenting Problem", "2. Hospital Course",
+                         "3. Key Medical History", "4. Discharge Summary"))
+    for i, word in enumerate(text.split(" ")[:max_tokens]):
+        yield word if i == 0 else " " + word
+
+def stream_generate(prompt, max_tokens=700, temperature=0.2, timeout=None):
+    """Yield the completion in pieces as the LLM backend produces them."""
+    if LLM_BACKEND == "stub":
+        yield from _stub_stream(prompt, max_tokens)
+        return
+    if LLM_BACKEND != "openai":
+        raise ValueError(f"unknown LLM_BACKEND {LLM_BACKEND!r} (expected openai or stub)")
     if not OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY environment variable not set")
     openai.api_key = OPENAI_API_KEY
@@ -25,46 +58,138 @@ def generate(prompt, max_tokens=700, temperature=0.2):
             {"role": "user", "content": prompt}
         ],
         temperature=temperature,
-        max_tokens=max_tokens
+        max_tokens=max_tokens,
+        stream=True,
+        **({"request_timeout": timeout} if timeout else {})
     )
-    return response.choices[0].message['content']
+    for chunk in response:
+        piece = chunk.choices[0].delta.get("content")
+        if piece:
+            yield piece
+
+@sm.timed("generation", "llm", rows=1)
+def generate(prompt, max_tokens=700, temperature=0.2, timeout=None):
+    return "".join(stream_generate(prompt, max_tokens, temperature, timeout))
 
 # --- DATA RETRIEVAL ---
-def get_structured_data(ep_id):
+# Per relationship type: (relationship, target label, projection, order) —
+# only the fields format_facts() puts in the prompt.
+FACT_QUERIES = {
+    "encounters":  ("HAS_ENCOUNTER", "Encounter",
+                    "{id: x.id, start: r.start, end: r.end}", "r.start"),
+    "medications": ("RECEIVED", "Medication",
+                    "{drug: x.drug, start: r.start_ts, end: r.end_ts}", "r.start_ts"),
+    "labs":        ("HAS_LAB", "LabTest",
+                    "{label: x.label, n: r.count, last: r.last, last_ts: r.ts[-1], "
+                    "min: r.min, max: r.max, unit: r.unit}", "r.count DESC, x.label"),
+    "procedures":  ("UNDERWENT", "Procedure",
+                    "{code: x.code, name: x.name, ts: r.ts}", "r.ts"),
+}
+MAX_FACTS = int(os.environ.get("KG_MAX_FACTS", "50"))   # per episode and type
+KG_BATCH = 500                                          # ep_ids per UNWIND
+
+def fetch_structured_batch(session, ep_ids, max_per_type=MAX_FACTS):
+    """{ep_id: {"episode": {t0, t1}, type: [facts]}} on an open Neo4j session,
+    with one round trip per relationship type per KG_BATCH episodes."""
+    m = sm.get("retrieval")
+    out = {ep: {"episode": None, **{t: [] for t in FACT_QUERIES}} for ep in ep_ids}
+    eps = list(out)
+    for i in range(0, len(eps), KG_BATCH):
+        chunk = eps[i:i + KG_BATCH]
+        for r in session.run("""
+            UNWIND $ep_ids AS ep
+            MATCH (e:Episode {ep_id: ep})
+            RETURN ep, e.t0 AS t0, e.t1 AS t1
+        """, ep_ids=chunk):
+            out[r["ep"]]["episode"] = {"t0": r["t0"], "t1": r["t1"]}
+        m.roundtrip("neo4j")
+        for typ, (rel, label, proj, order) in FACT_QUERIES.items():
+            for r in session.run(f"""
+                UNWIND $ep_ids AS ep
+                MATCH (:Episode {{ep_id: ep}})-[r:{rel}]->(x:{label})
+                WITH ep, r, x ORDER BY ep, {order}
+                RETURN ep, collect({proj})[..$cap] AS facts
+            """, ep_ids=chunk, cap=max_per_type):
+                out[r["ep"]][typ] = r["facts"]
+            m.roundtrip("neo4j")
+    return out
+
+@sm.timed("retrieval", "kg")
+def get_structured_data_batch(ep_ids, max_per_type=MAX_FACTS):
     with GraphDatabase.driver(NEO_URI, auth=NEO_AUTH) as driver:
         with driver.session() as session:
-            result = session.run("""
-                MATCH (e:Episode {ep_id: $ep_id})-[r]->(x)
-                RETURN e, r, x
-            """, ep_id=ep_id)
-            return result.data()
-
-def get_unstructured_data(ep_id, model, client, collection_name="notes_chunks_dev"):
-    query_vector = model.encode([f"[query] Clinical notes for episode {ep_id}"], normalize_embeddings=True)[0]
-    hits = client.search(
-        collection_name=collection_name,
-        query_vector=query_vector,
-        limit=10,
-        query_filter={"must": [{"key": "ep_id", "match": {"value": ep_id}}]}
-    )
+            return fetch_structured_batch(session, ep_ids, max_per_type)
+
+def get_structured_data(ep_id, max_per_type=MAX_FACTS):
+    return get_structured_data_batch([ep_id], max_per_type)[ep_id]
+
+def open_vector_store(collection_name="notes_chunks_dev", backend=None):
+    return vs.open_store(backend or VECTOR_BACKEND, collection_name, url=QDRANT_URL)
+
+def get_unstructured_data(ep_id, model, store, limit=10):
+    m = sm.get("retrieval")
+    with m.batch("encode"):
+        query_vector = model.encode([f"[query] Clinical notes for episode {ep_id}"], normalize_embeddings=True)[0]
+    with m.batch("search", rows=1):
+        hits = store.search(query_vector, limit=limit, ep_id=ep_id)
+    m.roundtrip(store.backend)
     return hits
 
+@sm.timed("retrieval", "pack", rows=1)
+def get_evidence_pack(ep_id, packs):
+    """(structured_data, notes) for `ep_id` from a PackReader, without any DB round trip."""
+    pack = packs.get(ep_id)
+    if pack is None:
+        raise KeyError(f"no evidence pack for episode {ep_id}")
+    return pack["facts"], pack["notes"]
+
 # --- PROMPT ENGINEERING ---
+def _span(a, b):
+    return f"{a} → {b}" if b and b != a else f"{a}"
+
+def format_facts(facts, types=tuple(FACT_QUERIES)):
+    """Structured facts (see fetch_structured_batch) as prompt lines."""
+    if not isinstance(facts, dict):
+        return str(facts)   # packs built before the projected fetch
+    ep = facts.get("episode") or {}
+    lines = [f"Episode window: {_span(ep.get('t0'), ep.get('t1'))}"] if ep else []
+    rows = {
+        "encounters": lambda f: f"{_span(f['start'], f['end'])} (encounter {f['id']})",
+        "medications": lambda f: f"{f['drug']} ({_span(f['start'], f['end'])})",
+        "labs": lambda f: (f"{f['label']}: last {f['last']}{' ' + f['unit'] if f['unit'] else ''}"
+                           f" at {f['last_ts']}, n={f['n']}"
+                           + (f", range {f['min']}–{f['max']}" if f['min'] is not None else "")),
+        "procedures": lambda f: f"{f['ts']} {f['name'] or ''} [{f['code']}]",
+    }
+    for typ in types:
+        fmt = rows[typ]
+        items = facts.get(typ) or []
+        lines.append(f"{typ.capitalize()}:")
+        lines += [f"- {fmt(f)}" for f in items] or ["- none recorded"]
+    return "\n    ".join(lines)
+
 def format_prompt(ep_id, structured_data, unstructured_data):
-    # This is a simplified example. You would format the data more nicely.
     prompt = f"""
     Generate a clinical summary for the patient episode: {ep_id}
 
     **Structured Episode Data:**
-    {structured_data}
+    {format_facts(structured_data)}
 
     **Unstructured Clinical Notes (ranked by relevance):**
     """
-    for hit in unstructured_data:
-        prompt += f"--- Note (Timestamp: {hit.payload['ts']}, Section: {hit.payload['section']}) ---\n"
-        prompt += f"{hit.payload['text']}\n"
+    prompt += format_notes(unstructured_data)
+    prompt += SUMMARY_TASK
+    return prompt
 
-    prompt += """
+def format_notes(notes):
+    out = ""
+    for hit in notes:
+        note = getattr(hit, "payload", hit)   # vector store Hit or evidence-pack note
+        out += f"--- Note (Timestamp: {note['ts']}, Section: {note['section']}) ---\n"
+        out += f"{note['text']}\n"
+    return out
+
+SUMMARY_TASK = """
     **Task:**
     Based ONLY on the information provided above, generate a summary covering the following sections:
     1. Presenting Problem
@@ -77,29 +202,186 @@ def format_prompt(ep_id, structured_data, unstructured_data):
     - Be concise and use clear medical terminology.
     - If a section cannot be filled due to lack of information, state 'Information not available.'
     """
+
+# --- HIERARCHICAL (MAP-REDUCE) SUMMARIZATION ---
+# Long episodes: summarize chronological slices of the evidence concurrently
+# (map), then write the four-section summary from the partials (reduce).
+MAP_TYPES = ("encounters", "medications", "procedures")   # labs are episode-wide series → reduce
+FACT_TS = {"encounters": "start", "medications": "start", "procedures": "ts"}
+
+def _ts_key(v):
+    # neo4j DateTime, datetime and their str() forms → sortable "YYYY-MM-DDTHH:MM:SS"
+    return str(v)[:19].replace(" ", "T") if v is not None else ""
+
+def split_evidence(notes, max_partials=6, window_hours=24):
+    """Notes → at most `max_partials` chronological groups: one per encounter
+    when notes carry one (vector store payloads), else per `window_hours`
+    window; the smallest adjacent groups are merged first."""
+    notes = sorted((getattr(n, "payload", n) for n in notes), key=lambda n: _ts_key(n.get("ts")))
+    groups, prev = [], object()
+    for n in notes:
+        key = n.get("encounter")
+        if not key:
+            try:
+                t = datetime.fromisoformat(_ts_key(n.get("ts")))
+                key = int(t.timestamp() // (window_hours * 3600))
+            except ValueError:
+                key = None
+        if groups and key == prev:
+            groups[-1].append(n)
+        else:
+            groups.append([n])
+        prev = key
+    while len(groups) > max(max_partials, 1):
+        i = min(range(len(groups) - 1), key=lambda i: len(groups[i]) + len(groups[i + 1]))
+        groups[i:i + 2] = [groups[i] + groups[i + 1]]
+    return groups
+
+def assign_facts(structured_data, groups):
+    """Per group, the MAP_TYPES facts dated from its first note up to the next group's."""
+    parts = [{t: [] for t in MAP_TYPES} for _ in groups]
+    if not isinstance(structured_data, dict) or not groups:
+        return parts
+    starts = [_ts_key(g[0].get("ts")) for g in groups]
+    for typ in MAP_TYPES:
+        for f in structured_data.get(typ) or []:
+            i = max(bisect_right(starts, _ts_key(f.get(FACT_TS[typ]))) - 1, 0)
+            parts[i][typ].append(f)
+    return parts
+
+def partial_prompt(ep_id, i, k, facts, notes):
+    prompt = f"""
+    Summarize part {i} of {k} ({_span(notes[0].get('ts'), notes[-1].get('ts'))}) of the patient episode: {ep_id}
+
+    **Structured Data (this part):**
+    {format_facts(facts, MAP_TYPES)}
+
+    **Clinical Notes (chronological):**
+    """
+    prompt += format_notes(notes)
+    prompt += """
+    **Task:**
+    List the problems, events, treatments and results in this part, with dates, as short bullet points (at most 150 words).
+    Use ONLY the information above; do not infer or add anything.
+    """
+    return prompt
+
+def reduce_prompt(ep_id, structured_data, partials):
+    prompt = f"""
+    Generate a clinical summary for the patient episode: {ep_id}
+
+    **Structured Episode Data:**
+    {format_facts(structured_data, ("labs",))}
+
+    **Partial Summaries (chronological):**
+    """
+    for i, (span, text) in enumerate(partials, 1):
+        prompt += f"--- Part {i} ({span}) ---\n{text}\n"
+    prompt += SUMMARY_TASK
     return prompt
 
+def _stream(m, prompt, max_tokens, timeout=None):
+    t = time.perf_counter()
+    first = True
+    for piece in stream_generate(prompt, max_tokens, timeout=timeout):
+        if first:
+            m.observe("ttft", time.perf_counter() - t)
+            first = False
+        yield piece
+    m.observe("llm", time.perf_counter() - t, rows=1)
+
+def summarize_episode(ep_id, structured_data, notes, mode="auto", max_prompt_chars=24000,
+                      max_partials=6, window_hours=24, partial_max_tokens=350,
+                      partial_timeout=60.0, max_tokens=700, timeout=120.0):
+    """Yield the episode summary in pieces as the final LLM call streams it.
+
+    mode "single" sends one prompt; "map-reduce" summarizes up to
+    `max_partials` evidence slices concurrently, then reduces them; "auto"
+    picks map-reduce only when the single prompt exceeds `max_prompt_chars`.
+    Partials that miss `partial_timeout` are left out, and the final (single
+    or reduce) call gets `timeout`, so the worst case is about
+    `partial_timeout + timeout`."""
+    m = sm.get("generation")
+    prompt = format_prompt(ep_id, structured_data, notes)
+    groups = split_evidence(notes, max_partials, window_hours) if mode != "single" else []
+    if mode == "single" or not groups or (mode == "auto" and len(prompt) <= max_prompt_chars):
+        yield from _stream(m, prompt, max_tokens, timeout)
+        return
+
+    k = len(groups)
+    prompts = [partial_prompt(ep_id, i, k, f, g)
+               for i, (f, g) in enumerate(zip(assign_facts(structured_data, groups), groups), 1)]
+    ex = ThreadPoolExecutor(max_workers=k)
+    with m.batch("map"):
+        futs = [ex.submit(generate, p, partial_max_tokens, 0.2, partial_timeout) for p in prompts]
+        done, _ = wait(futs, timeout=partial_timeout)
+    ex.shutdown(wait=False, cancel_futures=True)   # don't wait for stragglers
+
+    partials = []
+    for i, (g, f) in enumerate(zip(groups, futs), 1):
+        span = _span(g[0].get("ts"), g[-1].get("ts"))
+        if f in done and f.exception() is None:
+            partials.append((span, f.result()))
+        else:
+            err = f.exception() if f in done else f"timeout after {partial_timeout}s"
+            print(f"[!] partial {i}/{k} ({span}) dropped: {err}", file=sys.stderr)
+            partials.append((span, "(partial summary unavailable)"))
+    yield from _stream(m, reduce_prompt(ep_id, structured_data, partials), max_tokens, timeout)
+
 def main():
-    # --- Get a sample episode ID ---
-    with psycopg2.connect(PG_DSN) as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT ep_id FROM coh.episodes LIMIT 1")
-            ep_id = cur.fetchone()[0]
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ep-id", default=None, help="Episode to summarize (default: any)")
+    ap.add_argument("--packs", default=os.environ.get("EVIDENCE_PACKS"),
+                    help="Evidence pack file from build_evidence_packs.py; no DB is contacted")
+    ap.add_argument("--backend", default=VECTOR_BACKEND, choices=vs.BACKENDS,
+                    help="Vector store for note retrieval (local = embedded store, no Qdrant)")
+    ap.add_argument("--mode", default="auto", choices=("auto", "single", "map-reduce"),
+                    help="auto = map-reduce only when the single prompt exceeds --max-prompt-chars")
+    ap.add_argument("--max-prompt-chars", type=int, default=24000)
+    ap.add_argument("--max-partials", type=int, default=6, help="Concurrent partial summaries (map step)")
+    ap.add_argument("--window-hours", type=float, default=24.0,
+                    help="Evidence slice length when notes carry no encounter")
+    ap.add_argument("--partial-timeout", type=float, default=60.0,
+                    help="Seconds to wait for partial summaries before reducing without the rest")
+    ap.add_argument("--timeout", type=float, default=120.0,
+                    help="Request timeout (s) of the final single/reduce LLM call")
+    ap.add_argument("--top-k", type=int, default=None,
+                    help="Notes retrieved (default 10; 60 with --mode map-reduce)")
+    sm.add_metrics_args(ap)
+    args = ap.parse_args()
+    sm.configure_from_args(args)
 
-    # --- Initialize clients ---
-    model = SentenceTransformer('intfloat/e5-base-v2')
-    qdrant_client = QdrantClient(QDRANT_URL)
+    if args.packs:
+        # --- Offline evidence ---
+        with PackReader(args.packs) as packs:
+            ep_id = args.ep_id or next(iter(packs.keys()))
+            structured_data, unstructured_data = get_evidence_pack(ep_id, packs)
+    else:
+        # --- Get a sample episode ID ---
+        ep_id = args.ep_id
+        if ep_id is None:
+            with psycopg2.connect(PG_DSN) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT ep_id FROM coh.episodes LIMIT 1")
+                    ep_id = cur.fetchone()[0]
 
-    # --- Retrieve data ---
-    structured_data = get_structured_data(ep_id)
-    unstructured_data = get_unstructured_data(ep_id, model, qdrant_client)
+        # --- Initialize clients ---
+        model = SentenceTransformer('intfloat/e5-base-v2')
+        store = open_vector_store(backend=args.backend)
 
-    # --- Generate prompt and summary ---
-    prompt = format_prompt(ep_id, structured_data, unstructured_data)
-    summary = generate(prompt)
+        # --- Retrieve data ---
+        structured_data = get_structured_data(ep_id)
+        top_k = args.top_k or (60 if args.mode == "map-reduce" else 10)
+        unstructured_data = get_unstructured_data(ep_id, model, store, limit=top_k)
 
+    # --- Generate and stream the summary ---
     print(f"--- Summary for Episode: {ep_id} ---")
-    print(summary)
+    with sm.profile():
+        for piece in summarize_episode(ep_id, structured_data, unstructured_data, args.mode,
+                                       args.max_prompt_chars, args.max_partials, args.window_hours,
+                                       partial_timeout=args.partial_timeout, timeout=args.timeout):
+            print(piece, end="", flush=True)
+    print()
 
 if __name__ == "__main__":
     main()
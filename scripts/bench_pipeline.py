@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the pipeline stages on synthetic Coherent-shaped data
+(scripts/gen_synthetic_coherent.py), written as JSON for commit-to-commit
+comparison.
+
+Stages:
+  extract      FHIR bundles → note rows (no DB)
+  notes_insert rows → coh.notes                                  (--dsn)
+  episodes     full + incremental coh.episodes refresh           (--dsn)
+  note_xwalk   crosswalk + coh.episode_notes sweep               (--dsn)
+  embed_upsert encode notes + upsert into in-memory Qdrant (or --vector-backend local)
+  kg_upsert    Postgres → Neo4j                                  (--dsn, --neo-uri)
+  retrieval    ep_id-filtered search latency (p50/p95/p99)
+
+DB stages run sql/schema.sql, which DROPs the coh schema: point --dsn at a
+scratch database. Stages whose services or packages are unavailable are
+recorded as {"skipped": reason}.
+
+  python scripts/bench_pipeline.py --patients 500 --out bench.json
+  python scripts/bench_pipeline.py --dsn "host=localhost dbname=bench user=mimic password=strong_password" \\
+      --neo-uri bolt://localhost:7687 --out bench.json
+"""
+
+import os, sys, json, time, random, argparse, platform, subprocess, statistics
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+from gen_synthetic_coherent import generate, write_zip
+from fhir_io import list_bundles, read_bundles
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "-C", ROOT, "rev-parse", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def timed(rows, secs, **extra):
+    return {"rows": rows, "seconds": round(secs, 4),
+            "rows_per_s": round(rows / max(secs, 1e-9), 1), **extra}
+
+
+def percentiles(lat):
+    lat = sorted(lat)
+    pick = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))]
+    return {"n": len(lat), "mean_ms": round(statistics.mean(lat) * 1e3, 3),
+            "p50_ms": round(pick(0.50) * 1e3, 3), "p95_ms": round(pick(0.95) * 1e3, 3),
+            "p99_ms": round(pick(0.99) * 1e3, 3)}
+
+
+# ---------- stages ----------
+def stage_extract(ctx):
+    from extract_notes_from_fhir_bundle import bundle_rows
+    items = list_bundles(ctx["fhir"])
+    t0 = time.time(); rows = []
+    for _, b in read_bundles(items):
+        rows += bundle_rows(b)
+    secs = time.time() - t0
+    ctx["note_rows"] = rows
+    return timed(len(rows), secs, bundles=len(items), bundles_per_s=round(len(items) / max(secs, 1e-9), 1))
+
+
+def stage_notes_insert(ctx):
+    import psycopg2
+    from extract_notes_from_fhir_bundle import ensure_table, flush
+    from load_csv import ensure_state, copy_table
+    conn = psycopg2.connect(ctx["dsn"])
+    with conn.cursor() as cur, open(os.path.join(ROOT, "sql", "schema.sql")) as f:
+        cur.execute(f.read())
+    conn.commit()
+    ensure_state(conn, restart=True)
+    t = time.time(); csv_rows = 0
+    for fn in sorted(os.listdir(ctx["csv"])):
+        csv_rows += copy_table(ctx["dsn"], fn[:-4], os.path.join(ctx["csv"], fn))[1]
+    csv_secs = time.time() - t
+    ensure_table(conn)
+    rows = ctx["note_rows"]
+    t0 = time.time()
+    for i in range(0, len(rows), 5000):
+        flush(conn, rows[i:i + 5000])
+    secs = time.time() - t0
+    conn.close()
+    return timed(len(rows), secs, csv_rows=csv_rows, csv_seconds=round(csv_secs, 4))
+
+
+def stage_episodes(ctx):
+    import psycopg2
+    from refresh_episodes import all_patients, dirty_patients, refresh_group
+    conn = psycopg2.connect(ctx["dsn"])
+    patients, hwm = all_patients(conn)
+    conn.commit()
+    t0 = time.time()
+    added, _, _ = refresh_group(ctx["dsn"], patients, hwm, 5000)
+    full_secs = time.time() - t0
+
+    # incremental: one new encounter for ~1% of patients, then drain the dirty queue
+    rng = random.Random(ctx["seed"])
+    touched = rng.sample(patients, max(1, len(patients) // 100))
+    with conn.cursor() as cur:
+        for k, p in enumerate(touched):
+            cur.execute("""
+                INSERT INTO coh.encounters(id, start, stop, patient)
+                SELECT %s, MAX(stop) + INTERVAL '1 hour', MAX(stop) + INTERVAL '3 hours', %s
+                FROM coh.encounters WHERE patient = %s
+            """, (f"bench-{k}", p, p))
+    conn.commit()
+    dirty, hwm = dirty_patients(conn)
+    conn.commit(); conn.close()
+    t0 = time.time()
+    a, r, c = refresh_group(ctx["dsn"], dirty, hwm, 5000)
+    inc_secs = time.time() - t0
+    return {**timed(len(added), full_secs), "patients": len(patients),
+            "incremental": {**timed(len(dirty), inc_secs), "added": len(a),
+                            "removed": len(r), "changed": len(c)}}
+
+
+def stage_note_xwalk(ctx):
+    import psycopg2
+    from datetime import timedelta
+    from build_note_xwalk import ensure_tables, load_notes, build_xwalk, build_episode_notes
+    conn = psycopg2.connect(ctx["dsn"]); wconn = psycopg2.connect(ctx["dsn"])
+    ensure_tables(wconn)
+    t0 = time.time()
+    notes = load_notes(conn)
+    n_x = build_xwalk(conn, wconn, notes, None, timedelta(hours=24), 20000)
+    t1 = time.time()
+    n_e = build_episode_notes(conn, wconn, notes, None, 20000)
+    t2 = time.time()
+    with wconn.cursor() as cur:
+        cur.execute("""
+            SELECT note_id, ep_id, patient, encounter, ts, section, text
+            FROM coh.episode_notes WHERE text IS NOT NULL ORDER BY ep_id, ts
+        """)
+        ctx["episode_notes"] = [
+            {"id": nid, "ep_id": ep, "patient": pat, "encounter": enc,
+             "ts": str(ts), "section": sec, "text": txt}
+            for nid, ep, pat, enc, ts, sec, txt in cur.fetchall()]
+    conn.close(); wconn.close()
+    return {"xwalk": timed(n_x, t1 - t0), "episode_notes": timed(n_e, t2 - t1)}
+
+
+def stage_embed_upsert(ctx):
+    import tempfile
+    import vector_store as vs
+    from sentence_transformers import SentenceTransformer
+
+    recs = ctx.get("episode_notes")
+    if recs is None:
+        # no DB: scope notes per patient so filtered search still has ~episode-sized groups
+        recs = [{"id": i, "ep_id": p or "", "patient": p, "encounter": e, "ts": ts,
+                 "section": sec, "text": txt}
+                for i, (p, e, ts, sec, txt) in enumerate(ctx["note_rows"], 1)]
+    t = time.time()
+    model = SentenceTransformer(ctx["model"], device="cpu")
+    load_secs = time.time() - t
+    dim = model.get_sentence_embedding_dimension()
+    store = vs.open_store(ctx["vector_backend"], "bench", url=":memory:",
+                          path=tempfile.mkdtemp(prefix="bench_vectors_"))
+    store.ensure(dim, recreate=True)
+
+    enc_secs = ups_secs = 0.0
+    for i in range(0, len(recs), ctx["batch"]):
+        buf = recs[i:i + ctx["batch"]]
+        t = time.time()
+        vecs = model.encode([b["text"] for b in buf], batch_size=64,
+                            normalize_embeddings=True, convert_to_numpy=True)
+        enc_secs += time.time() - t
+        t = time.time()
+        store.upsert(list(range(i, i + len(buf))), vecs, buf)
+        ups_secs += time.time() - t
+    t = time.time()
+    store.close()
+    ups_secs += time.time() - t
+    ctx["store"], ctx["encoder"], ctx["ep_ids"] = store, model, sorted({r["ep_id"] for r in recs})
+    return {"model": ctx["model"], "backend": store.backend, "model_load_seconds": round(load_secs, 3),
+            "encode": timed(len(recs), enc_secs), "upsert": timed(len(recs), ups_secs)}
+
+
+def stage_kg_upsert(ctx):
+    import kg_upsert_structured as kg
+    from neo4j import basic_auth
+    kg.PG_DSN = ctx["dsn"]
+    kg.NEO_URI = ctx["neo_uri"]
+    kg.NEO_AUTH = basic_auth(*ctx["neo_auth"].split(":", 1))
+    t0 = time.time()
+    kg.upsert()
+    return {"seconds": round(time.time() - t0, 4)}
+
+
+def stage_retrieval(ctx):
+    store, model, eps = ctx["store"], ctx["encoder"], ctx["ep_ids"]
+    rng = random.Random(ctx["seed"])
+    enc_lat, search_lat = [], []
+    for _ in range(ctx["queries"]):
+        ep = rng.choice(eps)
+        t = time.time()
+        qv = model.encode([f"[query] Clinical notes for episode {ep}"], normalize_embeddings=True)[0]
+        enc_lat.append(time.time() - t)
+        t = time.time()
+        store.search(qv, limit=10, ep_id=ep)
+        search_lat.append(time.time() - t)
+    return {"encode": percentiles(enc_lat), "search": percentiles(search_lat)}
+
+
+STAGES = [
+    ("extract", stage_extract, ()),
+    ("notes_insert", stage_notes_insert, ("dsn",)),
+    ("episodes", stage_episodes, ("dsn",)),
+    ("note_xwalk", stage_note_xwalk, ("dsn",)),
+    ("embed_upsert", stage_embed_upsert, ()),
+    ("kg_upsert", stage_kg_upsert, ("dsn", "neo_uri")),
+    ("retrieval", stage_retrieval, ("store",)),
+]
+
+
+# ---------- main ----------
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data", default="synth_bench", help="Synthetic data dir (generated if missing)")
+    ap.add_argument("--patients", type=int, default=200)
+    ap.add_argument("--encounters-per-patient", type=float, default=8.0)
+    ap.add_argument("--note-chars", type=int, default=600)
+    ap.add_argument("--dup-rate", type=float, default=0.1)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--from-zip", action="store_true", help="Extract from <data>/coherent.zip")
+    ap.add_argument("--dsn", default=None, help="Scratch Postgres DSN (schema is dropped!)")
+    ap.add_argument("--neo-uri", default=None, help="Neo4j bolt URI for the KG stage")
+    ap.add_argument("--neo-auth", default="neo4j:neo4j_password", help="user:password")
+    ap.add_argument("--model", default="intfloat/e5-small-v2")
+    ap.add_argument("--batch", type=int, default=512, help="Embed/upsert batch size")
+    ap.add_argument("--vector-backend", default="qdrant", choices=("qdrant", "local"),
+                    help="Vector store for embed_upsert/retrieval (local = embedded mmap store)")
+    ap.add_argument("--queries", type=int, default=200, help="Retrieval queries")
+    ap.add_argument("--stages", default=None, help="Comma-separated subset of stages")
+    ap.add_argument("--out", default="bench.json")
+    args = ap.parse_args()
+
+    if not os.path.isdir(os.path.join(args.data, "fhir")):
+        print(f"[i] Generating synthetic data in {args.data}")
+        summary = generate(args.data, args.patients, args.encounters_per_patient,
+                           args.note_chars, args.dup_rate, args.seed, make_zip=args.from_zip)
+    else:
+        summary = {"reused": True}
+        if args.from_zip and not os.path.exists(os.path.join(args.data, "coherent.zip")):
+            print(f"[i] Packing {args.data}/coherent.zip")
+            write_zip(args.data)
+
+    ctx = {**vars(args),
+           "fhir": os.path.join(args.data, "coherent.zip" if args.from_zip else "fhir"),
+           "csv": os.path.join(args.data, "csv")}
+    wanted = set(args.stages.split(",")) if args.stages else None
+    if not list_bundles(ctx["fhir"]):   # a missing path raises FileNotFoundError
+        raise SystemExit(f"[!] no FHIR bundles in {ctx['fhir']}; refusing to benchmark 0 bundles")
+
+    results = {}
+    for name, fn, needs in STAGES:
+        if wanted and name not in wanted:
+            continue
+        missing = [k for k in needs if not ctx.get(k)]
+        if missing:
+            results[name] = {"skipped": f"needs {', '.join(missing)}"}
+        else:
+            try:
+                results[name] = fn(ctx)
+            except ImportError as e:
+                results[name] = {"skipped": f"missing package: {e.name}"}
+            except Exception as e:
+                results[name] = {"error": f"{type(e).__name__}: {e}"}
+        print(f"[{name}] {json.dumps(results[name])}")
+
+    report = {
+        "meta": {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                 "python": sys.version.split()[0], "platform": platform.platform(),
+                 "params": {k: getattr(args, k) for k in ("patients", "encounters_per_patient",
+                                                          "note_chars", "dup_rate", "seed", "model",
+                                                          "batch", "vector_backend", "queries", "from_zip")},
+                 "data": summary},
+        "stages": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"[done] → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
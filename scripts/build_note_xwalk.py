@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Map notes → CSV encounters (coh.encounter_xwalk, coh.notes.encounter_csv)
+and notes → episodes (coh.episode_notes) with a per-patient sweep.
+
+Instead of joining every note to every encounter/episode of the patient
+with a BETWEEN and ranking a huge candidate table, note metadata is held
+per patient (sorted by ts) while encounters/episodes are streamed in
+(patient, start) order. For each patient a single sorted sweep keeps only
+the intervals that can still contain the current note.
+
+  python scripts/build_note_xwalk.py                          # full rebuild
+  python scripts/build_note_xwalk.py --delta episodes_delta.json   # only touched patients
+  python scripts/build_note_xwalk.py --stage episode-notes
+"""
+
+import os, io, json, time, argparse
+from datetime import timedelta
+from itertools import groupby
+import psycopg2
+
+DEFAULT_DSN = os.environ.get(
+    "PG_DSN",
+    "host=localhost dbname=synthea user=mimic password=strong_password"
+)
+
+
+# ---------- DB helpers ----------
+def relkind(cur, name):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (name,))
+    r = cur.fetchone()
+    return r[0] if r else None
+
+
+def ensure_tables(conn):
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE coh.notes ADD COLUMN IF NOT EXISTS encounter_csv TEXT")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS coh.encounter_xwalk(
+          note_id     BIGINT,
+          patient     TEXT,
+          enc_id_fhir TEXT,
+          csv_id      TEXT
+        );
+        CREATE INDEX IF NOT EXISTS xwalk_patient_idx ON coh.encounter_xwalk(patient);
+        """)
+        # Older setups built episode_notes as a materialized view (README §6).
+        if relkind(cur, "coh.episode_notes") == "m":
+            print("[i] Replacing materialized view coh.episode_notes with a table "
+                  "(dependent views such as episode_notes_dev are dropped)")
+            cur.execute("DROP MATERIALIZED VIEW coh.episode_notes CASCADE")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS coh.episode_notes(
+          ep_id     TEXT,
+          note_id   BIGINT,
+          patient   TEXT,
+          encounter TEXT,
+          ts        TIMESTAMPTZ,
+          section   TEXT,
+          text      TEXT
+        );
+        CREATE INDEX IF NOT EXISTS epn_idx ON coh.episode_notes(ep_id, ts);
+        CREATE INDEX IF NOT EXISTS epn_patient_idx ON coh.episode_notes(patient);
+        """)
+    conn.commit()
+
+
+def _tsv(v):
+    if v is None:
+        return r"\N"
+    return str(v).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_rows(cur, table, cols, rows):
+    buf = io.StringIO()
+    for r in rows:
+        buf.write("\t".join(_tsv(v) for v in r) + "\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table}({', '.join(cols)}) FROM STDIN", buf)
+
+
+def stream(conn, name, sql, params=None, itersize=20000):
+    """Server-side cursor over `sql` (must be ordered by patient first)."""
+    with conn.cursor(name=name) as cur:
+        cur.itersize = itersize
+        cur.execute(sql, params)
+        for r in cur:
+            yield r
+
+
+# ---------- sweep ----------
+def sweep(points, intervals):
+    """
+    points:    [(ts, item), ...] sorted by ts
+    intervals: [(lo, hi, item), ...] sorted by lo
+    Yields (point_item, [interval_item, ...]) for every point with at least
+    one interval lo <= ts <= hi. Each interval enters and leaves the active
+    set once, so a patient costs O(notes + intervals + matches).
+    """
+    active = []
+    j = 0
+    for ts, pitem in points:
+        while j < len(intervals) and intervals[j][0] <= ts:
+            active.append(intervals[j]); j += 1
+        if active:
+            active = [iv for iv in active if iv[1] >= ts]
+        if active:
+            yield pitem, [iv[2] for iv in active]
+
+
+def load_notes(conn, patients=None):
+    """patient -> [(ts, (note_id, enc_id_fhir, ts)), ...] sorted by ts."""
+    sql = """
+        SELECT patient, id, encounter, ts FROM coh.notes
+        WHERE patient IS NOT NULL AND ts IS NOT NULL
+    """
+    params = None
+    if patients is not None:
+        sql += " AND patient = ANY(%s) "
+        params = (patients,)
+    sql += " ORDER BY patient, ts "
+    out = {}
+    for pat, nid, enc, ts in stream(conn, "xw_notes", sql, params):
+        out.setdefault(pat, []).append((ts, (nid, enc, ts)))
+    conn.commit()
+    return out
+
+
+def patient_filter(patients):
+    if patients is None:
+        return "", None
+    return " AND patient = ANY(%s) ", (patients,)
+
+
+# ---------- stage 1: encounter crosswalk ----------
+def build_xwalk(conn, wconn, notes, patients, window, batch):
+    """
+    Same result as the README §5 candidate join: for each (patient, FHIR
+    encounter) keep the CSV encounter whose start is closest to one of its
+    notes, among encounters within ±window of the note.
+    """
+    where, params = patient_filter(patients)
+    sql = f"""
+        SELECT patient, id, start::timestamptz,
+               COALESCE(stop, start)::timestamptz
+        FROM coh.encounters
+        WHERE patient IS NOT NULL AND start IS NOT NULL {where}
+        ORDER BY patient, start
+    """
+    with wconn.cursor() as cur:
+        if patients is None:
+            cur.execute("TRUNCATE coh.encounter_xwalk")
+        else:
+            cur.execute("DELETE FROM coh.encounter_xwalk WHERE patient = ANY(%s)", (patients,))
+            # the backfill only sets matched notes; clear stale links of the rest
+            cur.execute("""
+                UPDATE coh.notes SET encounter_csv = NULL
+                WHERE patient = ANY(%s) AND encounter_csv IS NOT NULL
+            """, (patients,))
+    wconn.commit()
+
+    rows = []; n_rows = 0; n_pat = 0
+    for pat, grp in groupby(stream(conn, "xw_enc", sql, params), key=lambda r: r[0]):
+        pts = [p for p in notes.get(pat, ()) if p[1][1] is not None]
+        if not pts:
+            continue
+        n_pat += 1
+        ivs = [(s - window, e + window, (cid, s)) for _, cid, s, e in grp]
+        best = {}  # enc_id_fhir -> (delta_sec, note_id, csv_id)
+        for (nid, enc, ts), cands in sweep(pts, ivs):
+            d, cid = min((abs((ts - s).total_seconds()), cid) for cid, s in cands)
+            if enc not in best or d < best[enc][0]:
+                best[enc] = (d, nid, cid)
+        for enc, (_, nid, cid) in best.items():
+            rows.append((nid, pat, enc, cid))
+        if len(rows) >= batch:
+            n_rows += write_xwalk(wconn, rows); rows = []
+            print(f"... {n_pat} patients, {n_rows} crosswalk rows")
+    n_rows += write_xwalk(wconn, rows)
+    conn.commit()
+    return n_rows
+
+
+def write_xwalk(wconn, rows):
+    """Append a batch to coh.encounter_xwalk and backfill coh.notes.encounter_csv."""
+    if not rows:
+        return 0
+    with wconn.cursor() as cur:
+        copy_rows(cur, "coh.encounter_xwalk", ("note_id", "patient", "enc_id_fhir", "csv_id"), rows)
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS _xw(note_id BIGINT, csv_id TEXT) ON COMMIT DELETE ROWS")
+        copy_rows(cur, "_xw", ("note_id", "csv_id"), [(r[0], r[3]) for r in rows])
+        cur.execute("""
+            UPDATE coh.notes n
+            SET encounter_csv = x.csv_id
+            FROM _xw x
+            WHERE n.id = x.note_id
+              AND (n.encounter_csv IS NULL OR n.encounter_csv <> x.csv_id)
+        """)
+    wconn.commit()
+    return len(rows)
+
+
+# ---------- stage 2: episode notes ----------
+def build_episode_notes(conn, wconn, notes, patients, batch):
+    where, params = patient_filter(patients)
+    sql = f"""
+        SELECT patient, ep_id, t0::timestamptz, t1::timestamptz
+        FROM coh.episodes
+        WHERE t0 IS NOT NULL AND t1 IS NOT NULL {where}
+        ORDER BY patient, t0
+    """
+    with wconn.cursor() as cur:
+        if patients is None:
+            cur.execute("TRUNCATE coh.episode_notes")
+        else:
+            cur.execute("DELETE FROM coh.episode_notes WHERE patient = ANY(%s)", (patients,))
+    wconn.commit()
+
+    pairs = []; n_rows = 0
+    for pat, grp in groupby(stream(conn, "xw_eps", sql, params), key=lambda r: r[0]):
+        pts = notes.get(pat)
+        if not pts:
+            continue
+        ivs = [(t0, t1, ep) for _, ep, t0, t1 in grp]
+        for (nid, _, _), eps in sweep(pts, ivs):
+            pairs.extend((ep, nid) for ep in eps)
+        if len(pairs) >= batch:
+            n_rows += write_episode_notes(wconn, pairs); pairs = []
+            print(f"... {n_rows} episode_notes rows")
+    n_rows += write_episode_notes(wconn, pairs)
+    conn.commit()
+    with wconn.cursor() as cur:
+        cur.execute("ANALYZE coh.episode_notes")
+    wconn.commit()
+    return n_rows
+
+
+def write_episode_notes(wconn, pairs):
+    """Insert (ep_id, note_id) pairs; note text is joined server-side."""
+    if not pairs:
+        return 0
+    with wconn.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS _epn(ep_id TEXT, note_id BIGINT) ON COMMIT DELETE ROWS")
+        copy_rows(cur, "_epn", ("ep_id", "note_id"), pairs)
+        cur.execute("""
+            INSERT INTO coh.episode_notes(ep_id, note_id, patient, encounter, ts, section, text)
+            SELECT p.ep_id, n.id, n.patient, n.encounter_csv, n.ts, n.section, n.text
+            FROM _epn p JOIN coh.notes n ON n.id = p.note_id
+        """)
+    wconn.commit()
+    return len(pairs)
+
+
+# ---------- main ----------
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dsn", default=DEFAULT_DSN, help="Postgres DSN")
+    ap.add_argument("--stage", choices=["all", "xwalk", "episode-notes"], default="all")
+    ap.add_argument("--window-hours", type=float, default=24.0,
+                    help="Note may fall this long before start / after stop of an encounter")
+    ap.add_argument("--batch", type=int, default=20000, help="Rows written per transaction")
+    ap.add_argument("--delta", default=None,
+                    help="episodes_delta.json from refresh_episodes.py; only its patients are rebuilt")
+    ap.add_argument("--patients-file", default=None,
+                    help="Only rebuild these patients (one id per line)")
+    args = ap.parse_args()
+
+    patients = None
+    if args.delta:
+        with open(args.delta) as f:
+            patients = json.load(f)["patients"]
+    elif args.patients_file:
+        with open(args.patients_file) as f:
+            patients = [ln.strip() for ln in f if ln.strip()]
+    if patients is not None:
+        print(f"[i] Restricting to {len(patients)} patient(s)")
+
+    conn = psycopg2.connect(args.dsn)    # streaming reads
+    wconn = psycopg2.connect(args.dsn)   # batched writes
+    ensure_tables(wconn)
+
+    t0 = time.time()
+    notes = load_notes(conn, patients)
+    print(f"[i] Loaded {sum(len(v) for v in notes.values())} note timestamps "
+          f"for {len(notes)} patients in {time.time() - t0:.1f}s")
+
+    if args.stage in ("all", "xwalk"):
+        t = time.time()
+        n = build_xwalk(conn, wconn, notes, patients, timedelta(hours=args.window_hours), args.batch)
+        print(f"[xwalk] {n} rows in {time.time() - t:.1f}s")
+
+    if args.stage in ("all", "episode-notes"):
+        t = time.time()
+        n = build_episode_notes(conn, wconn, notes, patients, args.batch)
+        print(f"[episode_notes] {n} rows in {time.time() - t:.1f}s")
+
+    conn.close(); wconn.close()
+    print(f"[done] {time.time() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
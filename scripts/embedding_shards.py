@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Embedding shards: note embeddings written once by the indexers
+(--shard-dir) and restored into any vector store by restore_shards.py,
+so rebuilding or replicating a collection needs no re-encoding.
+
+Layout of a shard directory:
+
+  manifest[.p<K>].json   {"format", "model", "dim", "dtype", "normalized",
+                          "created", "source", "shards": [{"name", "rows"}]}
+  <name>.npy             float32 (n, dim) matrix, np.load(mmap_mode="r")
+  <name>.ids.json        stable point ids (vector_store.point_id)
+  <name>.jsonl           one payload per row
+
+Each writer (one per indexer process, e.g. per partition) has its own
+manifest; readers take the union. Files are written under a temporary
+name and renamed, and a manifest is only written once its shards are
+complete.
+"""
+
+import os, json, glob, time
+import numpy as np
+
+FORMAT = 1
+
+
+def _replace_json(path, obj):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp, path)
+
+
+class ShardWriter:
+    def __init__(self, root, model, dim, rows_per_shard=20000, tag=None, source=None):
+        self.root = root
+        self.tag = tag
+        self.rows_per_shard = rows_per_shard
+        self.manifest = {"format": FORMAT, "model": model, "dim": dim, "dtype": "float32",
+                         "normalized": True, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                         "source": source, "shards": []}
+        self._ids, self._vecs, self._pay = [], [], []
+        os.makedirs(root, exist_ok=True)
+
+    def add(self, ids, vectors, payloads):
+        self._ids += list(ids)
+        self._vecs.append(np.asarray(vectors, dtype=np.float32))
+        self._pay += list(payloads)
+        if len(self._ids) >= self.rows_per_shard:
+            self._write()
+
+    def _write(self):
+        if not self._ids:
+            return
+        k = len(self.manifest["shards"])
+        name = f"shard-p{self.tag}-{k:05d}" if self.tag is not None else f"shard-{k:05d}"
+        base = os.path.join(self.root, name)
+        np.save(f"{base}.tmp.npy", np.concatenate(self._vecs))
+        os.replace(f"{base}.tmp.npy", f"{base}.npy")
+        _replace_json(f"{base}.ids.json", self._ids)
+        with open(f"{base}.jsonl.tmp", "w") as f:
+            for p in self._pay:
+                f.write(json.dumps(p, default=str) + "\n")
+        os.replace(f"{base}.jsonl.tmp", f"{base}.jsonl")
+        self.manifest["shards"].append({"name": name, "rows": len(self._ids)})
+        self._ids, self._vecs, self._pay = [], [], []
+
+    def close(self):
+        self._write()
+        fn = f"manifest.p{self.tag}.json" if self.tag is not None else "manifest.json"
+        _replace_json(os.path.join(self.root, fn), self.manifest)
+
+
+def read_manifest(root):
+    """Union of all manifests under `root` (they must agree on model and dim)."""
+    paths = sorted(glob.glob(os.path.join(root, "manifest*.json")))
+    if not paths:
+        raise FileNotFoundError(f"{root}: no manifest*.json (not a shard directory?)")
+    merged = None
+    for p in paths:
+        with open(p) as f:
+            m = json.load(f)
+        if m.get("format") != FORMAT:
+            raise ValueError(f"{p}: shard format {m.get('format')} (expected {FORMAT})")
+        if merged is None:
+            merged = {**m, "shards": []}
+        elif (m["model"], m["dim"]) != (merged["model"], merged["dim"]):
+            raise ValueError(f"{p}: model/dim {m['model']}/{m['dim']} differs from "
+                             f"{merged['model']}/{merged['dim']}")
+        merged["shards"] += m["shards"]
+    return merged
+
+
+def load_shard(root, name):
+    """(ids, vectors as a read-only memmap, payloads) of one shard."""
+    base = os.path.join(root, name)
+    vecs = np.load(f"{base}.npy", mmap_mode="r")
+    with open(f"{base}.ids.json") as f:
+        ids = json.load(f)
+    with open(f"{base}.jsonl") as f:
+        payloads = [json.loads(ln) for ln in f]
+    if not (len(ids) == len(payloads) == len(vecs)):
+        raise ValueError(f"{base}: ids/payloads/vectors row counts differ")
+    return ids, vecs, payloads
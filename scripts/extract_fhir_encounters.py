@@ -1,24 +1,17 @@
 #!/usr/bin/env python3
-import os, json, gzip, argparse, re, psycopg2
+import argparse, re, psycopg2
+from concurrent.futures import ProcessPoolExecutor
 from psycopg2.extras import execute_batch
+import fhir_io
+import stage_metrics as sm
 
 def rid(ref):
     if not ref: return None
     m=re.search(r"/([^/]+)$", ref); return m.group(1) if m else None
 
-def iter_bundles(root):
-    for r,_,fns in os.walk(root):
-        for fn in fns:
-            if not fn.lower().endswith((".json",".json.gz")): continue
-            p=os.path.join(r,fn)
-            op=gzip.open if fn.endswith(".gz") else open
-            try:
-                with op(p,"rt",encoding="utf-8") as f:
-                    b=json.load(f)
-                if isinstance(b,dict) and b.get("resourceType")=="Bundle":
-                    yield b
-            except Exception:
-                pass
+def iter_bundles(root, shard=0, nshards=1):
+    # root may be a directory, a single bundle, or the Coherent .zip
+    yield from fhir_io.iter_bundles(root, shard, nshards)
 
 def upsert(conn, rows):
     with conn.cursor() as cur:
@@ -37,16 +30,19 @@ def upsert(conn, rows):
         """, rows, page_size=1000)
     conn.commit()
 
-def main():
-    ap=argparse.ArgumentParser()
-    ap.add_argument("--fhir", default="coherent/fhir")
-    ap.add_argument("--dsn", default="host=localhost dbname=synthea user=mimic password=strong_password")
-    ap.add_argument("--limit", type=int, default=0)
-    args=ap.parse_args()
+def run_shard(dsn, root, limit, shard=0, nshards=1, mcfg=None):
+    if mcfg is not None:
+        sm.configure(**mcfg, worker=shard)
+    m=sm.get("extraction")
+    conn=psycopg2.connect(dsn)
+    with sm.profile():
+        nfiles=_run(conn, m, root, limit, shard, nshards)
+    conn.close()
+    return nfiles
 
-    conn=psycopg2.connect(args.dsn)
+def _run(conn, m, root, limit, shard, nshards):
     rows=[]; seen=set(); nfiles=0
-    for b in iter_bundles(args.fhir):
+    for b in iter_bundles(root, shard, nshards):
         nfiles+=1
         for ent in b.get("entry") or []:
             res=ent.get("resource") or {}
@@ -60,10 +56,37 @@ def main():
                 seen.add(key)
                 rows.append((pid,enc_id,start,stop))
             if len(rows)>=5000:
-                upsert(conn, rows); rows=[]
-        if args.limit and nfiles>=args.limit: break
-    if rows: upsert(conn, rows)
-    conn.close()
-    print("Done.")
+                with m.batch("insert", rows=len(rows)):
+                    upsert(conn, rows)
+                m.roundtrip("postgres", -(-len(rows)//1000) + 2); rows=[]   # DDL + pages + commit
+        m.report(every=10, extra=f"{nfiles} bundles")
+        if limit and nfiles>=limit: break
+    if rows:
+        with m.batch("insert", rows=len(rows)):
+            upsert(conn, rows)
+        m.roundtrip("postgres", -(-len(rows)//1000) + 2)
+    return nfiles
+
+def main():
+    ap=argparse.ArgumentParser()
+    ap.add_argument("--fhir", default="coherent/fhir", help="Bundle directory or the Coherent .zip")
+    ap.add_argument("--dsn", default="host=localhost dbname=synthea user=mimic password=strong_password")
+    ap.add_argument("--limit", type=int, default=0)
+    ap.add_argument("--workers", type=int, default=1, help="Parallel workers, bundles split by index")
+    sm.add_metrics_args(ap)
+    args=ap.parse_args()
+    sm.configure_from_args(args)
+
+    if args.workers>1:
+        # create the table once before workers race on CREATE TABLE IF NOT EXISTS
+        conn=psycopg2.connect(args.dsn); upsert(conn, []); conn.close()
+        limit=-(-args.limit//args.workers) if args.limit else 0
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            futs=[ex.submit(run_shard, args.dsn, args.fhir, limit, k, args.workers, sm.config())
+                  for k in range(args.workers)]
+            nfiles=sum(f.result() for f in futs)
+    else:
+        nfiles=run_shard(args.dsn, args.fhir, args.limit)
+    print(f"Done. Files: {nfiles}")
 
 if __name__=="__main__": main()
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
-import os, re, json, gzip, html, base64, argparse
+import re, html, time, base64, argparse
+from concurrent.futures import ProcessPoolExecutor
 import psycopg2
 from psycopg2.extras import execute_batch
+from fhir_io import list_bundles, read_bundles
+import stage_metrics as sm
 
 # ---------- DB helpers ----------
 def ensure_table(conn):
@@ -138,10 +141,7 @@ def from_generic_with_notes(res, resolve):
     return out
 
 # ---------- bundle walker ----------
-def process_bundle(path):
-    open_fn = gzip.open if path.endswith(".gz") else open
-    with open_fn(path, "rt", encoding="utf-8") as f:
-        bundle = json.load(f)
+def bundle_rows(bundle):
     if not (isinstance(bundle, dict) and bundle.get("resourceType")=="Bundle"):
         return []
 
@@ -156,35 +156,69 @@ def process_bundle(path):
         else:                          out += from_generic_with_notes(res, resolve)
     return out
 
+def process_bundle(path):
+    """Rows for one bundle file (*.json / *.json.gz / *.json.zst)."""
+    rows=[]
+    for _, bundle in read_bundles([(None, path)]):
+        rows = bundle_rows(bundle)
+    return rows
+
+def run_shard(dsn, items, mcfg=None, worker=None):
+    """Extract + insert one worker's share of bundles on its own connection."""
+    if mcfg is not None:
+        sm.configure(**mcfg, worker=worker)
+    m = sm.get("extraction")
+    conn = psycopg2.connect(dsn)
+    total=0; i=0
+    with sm.profile():
+        t = time.perf_counter()
+        for i, (_, bundle) in enumerate(read_bundles(items), 1):
+            m.observe("read", time.perf_counter() - t)
+            with m.batch("extract"):
+                rows = bundle_rows(bundle)
+            with m.batch("insert", rows=len(rows)):
+                flush(conn, rows)
+            if rows:
+                m.roundtrip("postgres", -(-len(rows) // 1000) + 1)   # execute_batch pages + commit
+            total += len(rows)
+            m.report(every=10, extra=f"{i}/{len(items)} bundles" + (f" (worker {worker})" if worker is not None else ""))
+            t = time.perf_counter()
+    conn.close()
+    return i, total
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--fhir", default="coherent/fhir", help="Directory with FHIR *.json / *.json.gz Bundles")
+    ap.add_argument("--fhir", default="coherent/fhir",
+                    help="Directory with FHIR *.json / *.json.gz / *.json.zst Bundles, "
+                         "or the Coherent .zip (read in place, no unzip)")
     ap.add_argument("--dsn",  default="host=localhost dbname=synthea user=mimic password=strong_password")
     ap.add_argument("--limit", type=int, default=0)
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Parallel workers; worker k takes bundles k, k+N, k+2N, ...")
+    sm.add_metrics_args(ap)
     args = ap.parse_args()
+    sm.configure_from_args(args)
 
-    files=[]
-    for root, _, fns in os.walk(args.fhir):
-        for fn in fns:
-            if fn.lower().endswith((".json", ".json.gz")):
-                files.append(os.path.join(root, fn))
-    files.sort()
-    if args.limit: files = files[:args.limit]
-    if not files:
-        raise SystemExit(f"No .json/.json.gz files found under {args.fhir}")
+    items = list_bundles(args.fhir)
+    if args.limit: items = items[:args.limit]
+    if not items:
+        raise SystemExit(f"No .json/.json.gz/.json.zst bundles found under {args.fhir}")
 
     conn = psycopg2.connect(args.dsn)
     ensure_table(conn)
-
-    total=0
-    for i, path in enumerate(files, 1):
-        rows = process_bundle(path)
-        flush(conn, rows)
-        total += len(rows)
-        if i % 50 == 0:
-            print(f"... processed {i} files, inserted ~{total} notes")
-    print(f"Done. Files: {len(files)}; notes inserted: ~{total}")
     conn.close()
 
+    if args.workers > 1:
+        nfiles=0; total=0
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            futs = [ex.submit(run_shard, args.dsn, items[k::args.workers], sm.config(), k)
+                    for k in range(args.workers)]
+            for fut in futs:
+                n, t = fut.result()
+                nfiles += n; total += t
+    else:
+        nfiles, total = run_shard(args.dsn, items)
+    print(f"Done. Files: {nfiles}; notes inserted: ~{total}")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read FHIR Bundles from a directory, a single file, or straight out of a
+.zip archive (e.g. coherent-11-07-2022.zip) without unpacking it.
+
+Members may be *.json, *.json.gz or *.json.zst (needs `zstandard`).
+list_bundles() returns a stable, sorted list of (container, member) items,
+so parallel workers can split the work by index: items[k::n].
+"""
+
+import os, io, json, gzip, zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BUNDLE_EXTS = (".json", ".json.gz", ".json.zst")
+
+
+def list_bundles(path):
+    """[(container, member), ...] — container is the .zip path, or None for plain files."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path}: no such FHIR bundle file, directory or zip")
+    if os.path.isfile(path) and zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            names = [i.filename for i in zf.infolist()
+                     if not i.is_dir() and i.filename.lower().endswith(BUNDLE_EXTS)]
+        return [(path, n) for n in sorted(names)]
+    if os.path.isfile(path):
+        return [(None, path)]
+    files = []
+    for root, _, fns in os.walk(path):
+        for fn in fns:
+            if fn.lower().endswith(BUNDLE_EXTS):
+                files.append(os.path.join(root, fn))
+    return [(None, f) for f in sorted(files)]
+
+
+def _text(name, raw):
+    """Wrap a binary stream in the right decompressor + UTF-8 decoder."""
+    n = name.lower()
+    if n.endswith(".gz"):
+        return gzip.open(raw, "rt", encoding="utf-8")
+    if n.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{name}: install `zstandard` to read .json.zst bundles")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw), encoding="utf-8")
+    return io.TextIOWrapper(raw, encoding="utf-8")
+
+
+def read_bundles(items, skip_errors=False):
+    """
+    Yield (member, parsed_json) for each item. Archives are opened once and
+    members are decompressed in memory, never written to disk.
+    """
+    zips = {}
+    try:
+        for container, name in items:
+            try:
+                if container:
+                    zf = zips.get(container)
+                    if zf is None:
+                        zf = zips[container] = zipfile.ZipFile(container)
+                    raw = zf.open(name)
+                else:
+                    raw = open(name, "rb")
+                with _text(name, raw) as f:
+                    doc = json.load(f)
+            except Exception:
+                if skip_errors:
+                    continue
+                raise
+            yield name, doc
+    finally:
+        for zf in zips.values():
+            zf.close()
+
+
+def iter_bundles(path, shard=0, nshards=1, skip_errors=True):
+    """Yield FHIR Bundle dicts under `path`; worker `shard` of `nshards` gets items[shard::nshards]."""
+    for _, doc in read_bundles(list_bundles(path)[shard::nshards], skip_errors=skip_errors):
+        if isinstance(doc, dict) and doc.get("resourceType") == "Bundle":
+            yield doc
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generate a small, seeded dataset shaped like Synthea Coherent:
+
+  <out>/csv/{patients,encounters,observations,medications,procedures}.csv
+  <out>/fhir/<patient>.json[.gz]      one Bundle per patient
+  <out>/coherent.zip                  (--zip) same files under coherent/
+
+CSV columns follow sql/schema.sql. Bundles carry Patient / Encounter /
+DiagnosticReport / DocumentReference resources with urn:uuid references
+and base64 text notes, like the real export; FHIR encounter ids differ
+from the CSV ids, so the crosswalk has to match by time as in Coherent.
+
+  python scripts/gen_synthetic_coherent.py --out synth --patients 200 --seed 7
+"""
+
+import os, csv, json, gzip, uuid, base64, random, zipfile, argparse
+from datetime import datetime, timedelta
+
+WORDS = (
+    "patient presents with acute chronic pain fever cough dyspnea stable "
+    "afebrile normotensive tachycardic history of hypertension diabetes "
+    "asthma prescribed continued discontinued follow up in clinic labs "
+    "reviewed imaging unremarkable plan discussed with family discharge "
+    "home tolerated procedure well no complications noted vitals within "
+    "normal limits medication reconciliation completed"
+).split()
+
+LABS = [("8867-4", "Heart rate", "/min", 60, 110), ("8480-6", "Systolic Blood Pressure", "mm[Hg]", 100, 160),
+        ("2339-0", "Glucose", "mg/dL", 70, 220), ("718-7", "Hemoglobin", "g/dL", 9, 17),
+        ("2160-0", "Creatinine", "mg/dL", 0.5, 2.5), ("6690-2", "Leukocytes", "10*3/uL", 3, 15)]
+MEDS = [("197361", "Amlodipine 5 MG Oral Tablet"), ("860975", "Metformin 500 MG Oral Tablet"),
+        ("308136", "Amoxicillin 500 MG Oral Capsule"), ("310965", "Ibuprofen 200 MG Oral Tablet"),
+        ("314076", "Lisinopril 10 MG Oral Tablet")]
+PROCS = [("710824005", "Assessment of health and social care needs"), ("430193006", "Medication reconciliation"),
+         ("76601001", "Intramuscular injection"), ("385763009", "Hospice care"), ("274804006", "Evaluation procedure")]
+ENC_CLASSES = ["wellness", "ambulatory", "outpatient", "emergency", "inpatient"]
+
+
+def iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def note_text(rng, mean_chars):
+    n = max(20, int(rng.uniform(0.5, 1.5) * mean_chars))
+    out = []; size = 0
+    while size < n:
+        w = rng.choice(WORDS); out.append(w); size += len(w) + 1
+    return " ".join(out).capitalize() + "."
+
+
+def b64(txt):
+    return base64.b64encode(txt.encode("utf-8")).decode("ascii")
+
+
+def gen_patient(rng, args, notes_seen):
+    """Return (csv rows by table, FHIR bundle) for one patient."""
+    pid = str(uuid.UUID(int=rng.getrandbits(128)))
+    birth = datetime(1940, 1, 1) + timedelta(days=rng.randint(0, 365 * 60))
+    rows = {"patients": [[pid, birth.date().isoformat(), "", "999-00-0000", "", "", "", "Syn", "Thetic",
+                          "", "", "M", "white", "nonhispanic", rng.choice("MF"), "Boston", "1 Main St",
+                          "Boston", "Massachusetts", "Suffolk County", "02101", 42.36, -71.06, 1000, 500]],
+            "encounters": [], "observations": [], "medications": [], "procedures": []}
+    entries = [{"fullUrl": f"urn:uuid:{pid}", "resource": {"resourceType": "Patient", "id": pid}}]
+
+    n_enc = max(1, int(rng.expovariate(1.0 / args.encounters_per_patient)))
+    t = birth + timedelta(days=rng.randint(365 * 18, 365 * 40))
+    for _ in range(n_enc):
+        # ~30% of encounters follow the previous one closely → multi-encounter episodes
+        t += timedelta(hours=rng.randint(2, 40)) if rng.random() < 0.3 else timedelta(days=rng.randint(3, 400))
+        start = t
+        stop = start + timedelta(minutes=rng.randint(15, 60 * 72))
+        t = stop
+        eid = str(uuid.UUID(int=rng.getrandbits(128)))
+        rows["encounters"].append([eid, iso(start), iso(stop), pid, "org-1", "prov-1", "payer-1",
+                                   rng.choice(ENC_CLASSES), "185349003", "Encounter for check up",
+                                   120.0, 250.0, 100.0, "", ""])
+        for code, label, unit, lo, hi in rng.sample(LABS, rng.randint(1, len(LABS))):
+            for _ in range(rng.randint(1, 3)):
+                ts = start + timedelta(minutes=rng.randint(0, max(1, int((stop - start).total_seconds() // 60))))
+                rows["observations"].append([iso(ts), pid, eid, code, label,
+                                             round(rng.uniform(lo, hi), 1), unit, "numeric"])
+        if rng.random() < 0.5:
+            code, desc = rng.choice(MEDS)
+            rows["medications"].append([iso(start), iso(stop), pid, "payer-1", eid, code, desc,
+                                        10.0, 5.0, 1, 10.0, "", ""])
+        if rng.random() < 0.4:
+            code, desc = rng.choice(PROCS)
+            rows["procedures"].append([iso(start), pid, eid, code, desc, 50.0, "", ""])
+
+        # FHIR side: its own encounter id, notes referencing it via urn:uuid
+        fid = str(uuid.UUID(int=rng.getrandbits(128)))
+        entries.append({"fullUrl": f"urn:uuid:{fid}", "resource": {
+            "resourceType": "Encounter", "id": fid,
+            "subject": {"reference": f"urn:uuid:{pid}"},
+            "period": {"start": iso(start), "end": iso(stop)}}})
+        for kind in ("DiagnosticReport", "DocumentReference"):
+            if notes_seen and rng.random() < args.dup_rate:
+                txt = rng.choice(notes_seen)
+            else:
+                txt = note_text(rng, args.note_chars)
+                notes_seen.append(txt)
+            ts = iso(start + timedelta(minutes=rng.randint(0, 120)))
+            nid = str(uuid.UUID(int=rng.getrandbits(128)))
+            if kind == "DiagnosticReport":
+                res = {"resourceType": kind, "id": nid, "subject": {"reference": f"urn:uuid:{pid}"},
+                       "encounter": {"reference": f"urn:uuid:{fid}"}, "effectiveDateTime": ts,
+                       "presentedForm": [{"contentType": "text/plain", "data": b64(txt)}]}
+            else:
+                res = {"resourceType": kind, "id": nid, "subject": {"reference": f"urn:uuid:{pid}"},
+                       "context": {"encounter": [{"reference": f"urn:uuid:{fid}"}]}, "date": ts,
+                       "content": [{"attachment": {"contentType": "text/plain", "data": b64(txt)}}]}
+            entries.append({"fullUrl": f"urn:uuid:{nid}", "resource": res})
+
+    bundle = {"resourceType": "Bundle", "type": "transaction", "entry": entries}
+    return pid, rows, bundle
+
+
+CSV_HEADERS = {
+    "patients": "Id,BIRTHDATE,DEATHDATE,SSN,DRIVERS,PASSPORT,PREFIX,FIRST,LAST,SUFFIX,MAIDEN,MARITAL,RACE,"
+                "ETHNICITY,GENDER,BIRTHPLACE,ADDRESS,CITY,STATE,COUNTY,ZIP,LAT,LON,HEALTHCARE_EXPENSES,"
+                "HEALTHCARE_COVERAGE",
+    "encounters": "Id,START,STOP,PATIENT,ORGANIZATION,PROVIDER,PAYER,ENCOUNTERCLASS,CODE,DESCRIPTION,"
+                  "BASE_ENCOUNTER_COST,TOTAL_CLAIM_COST,PAYER_COVERAGE,REASONCODE,REASONDESCRIPTION",
+    "observations": "DATE,PATIENT,ENCOUNTER,CODE,DESCRIPTION,VALUE,UNITS,TYPE",
+    "medications": "START,STOP,PATIENT,PAYER,ENCOUNTER,CODE,DESCRIPTION,BASE_COST,PAYER_COVERAGE,"
+                   "DISPENSES,TOTALCOST,REASONCODE,REASONDESCRIPTION",
+    "procedures": "DATE,PATIENT,ENCOUNTER,CODE,DESCRIPTION,BASE_COST,REASONCODE,REASONDESCRIPTION",
+}
+
+
+def write_zip(out):
+    """Pack <out>/csv and <out>/fhir into <out>/coherent.zip under coherent/."""
+    path = os.path.join(out, "coherent.zip")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for sub in ("csv", "fhir"):
+            for fn in sorted(os.listdir(os.path.join(out, sub))):
+                zf.write(os.path.join(out, sub, fn), f"coherent/{sub}/{fn}")
+    return path
+
+
+def generate(out, patients=100, encounters_per_patient=8, note_chars=600, dup_rate=0.1,
+             seed=0, gz=False, make_zip=False):
+    """Write the dataset under `out`; returns a small summary dict."""
+    args = argparse.Namespace(encounters_per_patient=encounters_per_patient,
+                              note_chars=note_chars, dup_rate=dup_rate)
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(out, "csv"), exist_ok=True)
+    os.makedirs(os.path.join(out, "fhir"), exist_ok=True)
+
+    writers, fhs = {}, {}
+    for tbl, header in CSV_HEADERS.items():
+        fhs[tbl] = open(os.path.join(out, "csv", f"{tbl}.csv"), "w", newline="")
+        writers[tbl] = csv.writer(fhs[tbl])
+        writers[tbl].writerow(header.split(","))
+
+    counts = {t: 0 for t in CSV_HEADERS}; notes_seen = []; bundles = []
+    for _ in range(patients):
+        pid, rows, bundle = gen_patient(rng, args, notes_seen)
+        for tbl, rs in rows.items():
+            writers[tbl].writerows(rs); counts[tbl] += len(rs)
+        data = json.dumps(bundle).encode("utf-8")
+        name = f"{pid}.json.gz" if gz else f"{pid}.json"
+        with open(os.path.join(out, "fhir", name), "wb") as f:
+            f.write(gzip.compress(data) if gz else data)
+        bundles.append(name)
+    for fh in fhs.values():
+        fh.close()
+
+    if make_zip:
+        write_zip(out)
+
+    return {"patients": patients, "bundles": len(bundles), "unique_notes": len(notes_seen), **counts}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default="synth", help="Output directory")
+    ap.add_argument("--patients", type=int, default=100)
+    ap.add_argument("--encounters-per-patient", type=float, default=8.0, help="Mean encounters per patient")
+    ap.add_argument("--note-chars", type=int, default=600, help="Mean note length in characters")
+    ap.add_argument("--dup-rate", type=float, default=0.1, help="Fraction of notes that repeat an earlier text")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--gz", action="store_true", help="Write bundles as .json.gz")
+    ap.add_argument("--zip", action="store_true", help="Also pack everything into <out>/coherent.zip")
+    args = ap.parse_args()
+
+    summary = generate(args.out, args.patients, args.encounters_per_patient, args.note_chars,
+                       args.dup_rate, args.seed, args.gz, args.zip)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
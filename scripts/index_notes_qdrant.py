@@ -1,7 +1,8 @@
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams, Distance, PointStruct
 from sentence_transformers import SentenceTransformer
-import psycopg2, time, torch
+import psycopg2, time, torch, argparse
+import stage_metrics as sm
+import vector_store as vs
+from embedding_shards import ShardWriter
 
 COL="notes_chunks"; QURL="http://localhost:6333"
 DSN="host=localhost dbname=synthea user=mimic password=strong_password"
@@ -31,42 +32,56 @@ def row_iter(limit=None):
             nid, ep, pat, enc, ts, sec, txt = r
             yield {"id":nid,"ep_id":ep,"patient":pat,"encounter":enc,"ts":str(ts),"section":sec,"text":txt}
 
-def main(limit=None):
+def main(limit=None, backend="qdrant", store_dir=None, store_dtype="float32",
+         shard_dir=None, shards_only=False):
     n_total = limit or total_rows()
-    print(f"[i] Target ~{n_total} notes | device={DEVICE} | model={MODEL_NAME}")
+    print(f"[i] Target ~{n_total} notes | device={DEVICE} | model={MODEL_NAME} | backend={backend}")
 
-    # Qdrant client; skip compatibility check
-    client = QdrantClient(QURL, timeout=60, check_compatibility=False)
-
-    # (re)create collection with explicit path
+    # (re)create collection / local store
     dim = 768 if "base" in MODEL_NAME else (384 if "small" in MODEL_NAME else 768)
-    if client.get_collection(COL) is not None:
-        client.delete_collection(COL)
-    client.create_collection(COL, vectors_config=VectorParams(size=dim, distance=Distance.COSINE))
+    store = None
+    if not shards_only:
+        store = vs.open_store(backend, COL, url=QURL, path=store_dir, dtype=store_dtype)
+        store.ensure(dim, recreate=True)
+    shards = ShardWriter(shard_dir, MODEL_NAME, dim, source="coh.episode_notes") if shard_dir else None
 
     model = SentenceTransformer(MODEL_NAME, device=DEVICE)
 
+    m=sm.get("indexing")
     t0=time.time()
     buf=[]; done=0; seen_any=False
 
     def flush():
         nonlocal buf, done, seen_any
         if not buf: return
+        m.queue_depth(len(buf))
         texts=[p["text"] for p in buf]
-        vecs=model.encode(texts, batch_size=ENCODE_BATCH, normalize_embeddings=True, convert_to_numpy=True)
-        points=[PointStruct(id=buf[i]["id"], vector=vecs[i].tolist(), payload=buf[i]) for i in range(len(buf))]
-        client.upsert(COL, points=points)
-        done += len(points); seen_any=True
-        rate = done / max(time.time()-t0, 1e-6)
-        print(f"[{done}/{n_total}] {rate:.1f} notes/s")
+        with m.batch("encode"):
+            vecs=model.encode(texts, batch_size=ENCODE_BATCH, normalize_embeddings=True, convert_to_numpy=True)
+        ids=[vs.point_id(b["id"], b["ep_id"]) for b in buf]
+        if shards is not None:
+            with m.batch("shard_write", rows=0 if store is not None else len(buf)):
+                shards.add(ids, vecs, buf)
+        if store is not None:
+            with m.batch("upsert", rows=len(buf)):
+                store.upsert(ids, vecs, buf)
+            m.roundtrip(backend)
+        done += len(buf); seen_any=True
+        m.report(n_total)
         buf=[]
 
     pulled=0
-    for rec in row_iter(limit):
-        pulled += 1
-        buf.append(rec)
-        if len(buf) >= UPSERT_BATCH: flush()
-    flush()
+    try:
+        with sm.profile():
+            for rec in row_iter(limit):
+                pulled += 1
+                buf.append(rec)
+                if len(buf) >= UPSERT_BATCH: flush()
+            flush()
+    finally:
+        if store is not None: store.close()
+        if shards is not None: shards.close()
+    m.roundtrip("postgres", pulled // 5000 + 1)
 
     if not seen_any:
         print("[!] Pulled 0 rows from coh.episode_notes. Check the view and REFRESH it.")
@@ -74,6 +89,14 @@ def main(limit=None):
         print(f"[done] {done} notes indexed in {time.time()-t0:.1f}s")
 
 if __name__=="__main__":
-    import sys
-    lim = int(sys.argv[1]) if len(sys.argv)>1 else None
-    main(lim)
+    ap=argparse.ArgumentParser()
+    ap.add_argument("limit", nargs="?", type=int, default=None, help="Optional: index only the first N notes")
+    vs.add_store_args(ap)
+    ap.add_argument("--shard-dir", default=None, help="Also write embeddings to shard files here (see restore_shards.py)")
+    ap.add_argument("--shards-only", action="store_true", help="With --shard-dir: only write shards")
+    sm.add_metrics_args(ap)
+    args=ap.parse_args()
+    if args.shards_only and not args.shard_dir:
+        ap.error("--shards-only needs --shard-dir")
+    sm.configure_from_args(args)
+    main(args.limit, args.backend, args.store_dir, args.store_dtype, args.shard_dir, args.shards_only)
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Index episode-scoped notes into a DEV Qdrant collection.
+Index episode-scoped notes into a DEV Qdrant collection (or, with
+--backend local, an embedded store under --store-dir; see vector_store.py).
+With --shard-dir the embeddings are also written to shard files that
+restore_shards.py can load into any collection without re-encoding.
 
 Defaults:
 - Source view: coh.episode_notes_dev (falls back to coh.episode_notes)
@@ -12,9 +15,10 @@ Defaults:
 
 import os, time, math, argparse
 import psycopg2
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams, Distance, PointStruct
 from sentence_transformers import SentenceTransformer
+import stage_metrics as sm
+import vector_store as vs
+from embedding_shards import ShardWriter
 
 try:
     import torch
@@ -27,7 +31,7 @@ DEFAULT_DSN = os.environ.get(
     "PG_DSN",
     "host=localhost dbname=synthea user=mimic password=strong_password"
 )
-DEFAULT_QURL = os.environ.get("QDRANT_URL", "http://localhost:6333")
+DEFAULT_QURL = vs.DEFAULT_QURL
 
 # ---------- helpers ----------
 def pick_device():
@@ -83,24 +87,21 @@ def row_iter(dsn, source_view, limit=None, ep_file=None):
                 "text": txt,
             }
 
-def ensure_collection(client: QdrantClient, name: str, dim: int, recreate: bool):
-    # Avoid deprecated get_collection kwargs; use collection_exists
-    if recreate and client.collection_exists(name):
-        client.delete_collection(name)
-    if not client.collection_exists(name):
-        client.create_collection(
-            collection_name=name,
-            vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
-        )
-
 # ---------- main ----------
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--dsn", default=DEFAULT_DSN, help="Postgres DSN")
     ap.add_argument("--qdrant-url", default=DEFAULT_QURL, help="Qdrant URL")
-    ap.add_argument("--collection", default="notes_chunks_dev", help="Qdrant collection")
+    ap.add_argument("--collection", default="notes_chunks_dev", help="Qdrant collection / local store name")
+    vs.add_store_args(ap)
     ap.add_argument("--source-view", default="coh.episode_notes_dev",
                    help="Source table/view. Falls back to coh.episode_notes if missing.")
+    ap.add_argument("--partition", type=int, default=None,
+                   help="On the partitioned schema, index only <source-view>_p<K> "
+                        "(run one process per partition after --create-only)")
+    ap.add_argument("--create-only", action="store_true",
+                   help="Create (or recreate, unless --append) the collection and exit; "
+                        "run once before parallel --partition workers")
     ap.add_argument("--episodes-file", default=None,
                    help="Optional file with ep_id (one per line) to filter rows")
     ap.add_argument("--model", default="intfloat/e5-base-v2",
@@ -110,20 +111,44 @@ def main():
     ap.add_argument("--limit", type=int, default=None, help="Limit number of rows")
     ap.add_argument("--append", action="store_true",
                    help="Append to existing collection (do not delete/recreate)")
+    ap.add_argument("--shard-dir", default=None,
+                   help="Also write embeddings to shard files here (see restore_shards.py)")
+    ap.add_argument("--shards-only", action="store_true",
+                   help="With --shard-dir: only write shards, do not touch the vector store")
+    sm.add_metrics_args(ap)
     args = ap.parse_args()
+    if args.shards_only and not args.shard_dir:
+        ap.error("--shards-only needs --shard-dir")
+    if args.partition is not None and args.backend == "local" and not args.shards_only:
+        ap.error("--partition needs --backend qdrant (a local store has a single writer)")
+    sm.configure_from_args(args, worker=args.partition)
 
     device = pick_device()
     dim = 768
     if "small" in args.model:
         dim = 384
 
+    if args.create_only:
+        store = vs.open_store(args.backend, args.collection, url=args.qdrant_url,
+                              path=args.store_dir, dtype=args.store_dtype)
+        store.ensure(dim, recreate=not args.append)
+        store.close()
+        print(f"[done] collection {args.collection} ({args.backend}) ready, dim={dim}")
+        return
+
     # Detect source view existence; fallback if needed
     source_view = args.source_view
+    if args.partition is not None:
+        # partitions exist only for partitioned tables (sql/schema_partitioned.sql)
+        source_view = f"{source_view}_p{args.partition}"
     with psycopg2.connect(args.dsn) as c, c.cursor() as cur:
         cur.execute("""
             SELECT to_regclass(%s) IS NOT NULL
-        """, (args.source_view,))
+        """, (source_view,))
         exists = cur.fetchone()[0]
+    if not exists and args.partition is not None:
+        raise SystemExit(f"[!] {source_view} not found: --partition needs a hash-partitioned "
+                         f"--source-view (e.g. coh.episode_notes on sql/schema_partitioned.sql)")
     if not exists:
         source_view = "coh.episode_notes"
         print(f"[i] Source view {args.source_view} not found; using {source_view}")
@@ -134,57 +159,81 @@ def main():
 
     print(f"[i] Source={source_view} rows={n_total} | device={device} | model={args.model} "
           f"| encode_batch={args.encode_batch} | upsert_batch={args.upsert_batch} "
-          f"| collection={args.collection}")
-
-    # Qdrant client
-    client = QdrantClient(args.qdrant_url, check_compatibility=False, timeout=60)
-    ensure_collection(client, args.collection, dim, recreate=(not args.append))
+          f"| collection={args.collection} ({args.backend})")
+
+    store = None
+    if not args.shards_only:
+        store = vs.open_store(args.backend, args.collection, url=args.qdrant_url,
+                              path=args.store_dir, dtype=args.store_dtype)
+        if args.partition is None:
+            store.ensure(dim, recreate=not args.append)
+        elif not store.exists():
+            # parallel partition workers would race on create_collection
+            raise SystemExit(f"[!] collection {args.collection} does not exist; "
+                             f"create it first with --create-only")
+    shards = None
+    if args.shard_dir:
+        shards = ShardWriter(args.shard_dir, args.model, dim, tag=args.partition, source=source_view)
 
     # Encoder
     model = SentenceTransformer(args.model, device=device)
 
+    m = sm.get("indexing")
     t0 = time.time()
+    t_fill = time.perf_counter()
     buf = []
     done = 0
 
     def flush():
-        nonlocal buf, done
+        nonlocal buf, done, t_fill
         if not buf:
             return
+        m.observe("fetch", time.perf_counter() - t_fill)
+        m.queue_depth(len(buf))
         texts = [b["text"] for b in buf]
-        vecs = model.encode(
-            texts,
-            batch_size=args.encode_batch,
-            normalize_embeddings=True,
-            convert_to_numpy=True,
-        )
-        points = [
-            PointStruct(id=buf[i]["id"], vector=vecs[i].tolist(), payload=buf[i])
-            for i in range(len(buf))
-        ]
-        client.upsert(args.collection, points=points)
-        done += len(points)
-        elapsed = time.time() - t0
-        rate = done / max(elapsed, 1e-6)
-        remaining = max(n_total - done, 0)
-        eta_min = (remaining / rate) / 60 if rate > 0 else float("inf")
-        print(f"[{done}/{n_total}] {rate:.1f} notes/s  ETA ~{eta_min:.1f} min")
+        with m.batch("encode"):
+            vecs = model.encode(
+                texts,
+                batch_size=args.encode_batch,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+            )
+        ids = [vs.point_id(b["id"], b["ep_id"]) for b in buf]
+        if shards is not None:
+            with m.batch("shard_write", rows=0 if store is not None else len(buf)):
+                shards.add(ids, vecs, buf)
+        if store is not None:
+            with m.batch("upsert", rows=len(buf)):
+                store.upsert(ids, vecs, buf)
+            m.roundtrip(args.backend)
+        done += len(buf)
+        m.report(n_total)
         buf.clear()
+        t_fill = time.perf_counter()
 
     pulled = 0
     try:
-        for rec in row_iter(args.dsn, source_view, args.limit, args.episodes_file):
-            pulled += 1
-            buf.append(rec)
-            if len(buf) >= args.upsert_batch:
-                flush()
-        flush()
+        with sm.profile():
+            for rec in row_iter(args.dsn, source_view, args.limit, args.episodes_file):
+                pulled += 1
+                buf.append(rec)
+                if len(buf) >= args.upsert_batch:
+                    flush()
+            flush()
     except KeyboardInterrupt:
         print("\n[!] Interrupted — flushing remaining batch …")
         flush()
+    finally:
+        # a local store only indexes what close() commits
+        if store is not None:
+            store.close()
+        if shards is not None:
+            shards.close()
+            print(f"[i] Shards → {args.shard_dir}")
+    m.roundtrip("postgres", pulled // 5000 + 1)   # named-cursor FETCHes (itersize=5000)
 
     total_s = time.time() - t0
-    print(f"[done] upserted {done}/{n_total} notes in {total_s/60:.1f} min")
+    print(f"[done] {'embedded' if args.shards_only else 'upserted'} {done}/{n_total} notes in {total_s/60:.1f} min")
 
 if __name__ == "__main__":
     main()
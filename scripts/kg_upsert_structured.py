@@ -1,26 +1,78 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sys
+import re
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import psycopg2
 from neo4j import GraphDatabase, basic_auth
+from partitions import partitions, rel
+import stage_metrics as sm
 
 # --- CONFIG ---
 PG_DSN  = "host=localhost dbname=synthea user=mimic password=strong_password"
 NEO_URI = "bolt://localhost:7687"
 NEO_AUTH = basic_auth("neo4j", "neo4j_password")
 
+# observation values that count towards HAS_LAB min/max (same test in SQL and Python)
+NUMERIC_RE = "^[-+]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][-+]?[0-9]+)?$"
+_numeric = re.compile(NUMERIC_RE)
+
 
 def q(sql, params=None):
     """Yield dict rows from Postgres."""
+    m = sm.get("kg_upsert")
     with psycopg2.connect(PG_DSN) as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, params or ())
+            with m.batch("pg_query"):
+                cur.execute(sql, params or ())
+                rows = cur.fetchall()
+            m.roundtrip("postgres")
             cols = [d[0] for d in cur.description] if cur.description else []
-            for r in cur.fetchall():
+            for r in rows:
                 yield dict(zip(cols, r))
 
 
+def timed_rows(op, rows):
+    """Yield `rows`, timing the loop body run for each one as an `op` batch."""
+    m = sm.get("kg_upsert")
+    for r in rows:
+        t = time.perf_counter()
+        yield r
+        m.observe(op, time.perf_counter() - t, rows=1)
+        m.report(every=10)
+
+
+def batched(rows, n):
+    buf = []
+    for r in rows:
+        buf.append(r)
+        if len(buf) >= n:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+def lab_series(r):
+    """One aggregated (episode, lab) row → HAS_LAB edge properties.
+    Neo4j arrays are homogeneous, so values are floats only if every one parses."""
+    raw = ["" if v is None else v.strip() for v in r["vals"]]
+    numeric = all(_numeric.match(v) for v in raw)
+    values = [float(v) for v in raw] if numeric else raw
+    return {"ep_id": r["ep_id"], "patient": r["patient"], "label": r["label"],
+            "ts": r["ts"], "values": values, "raw": raw, "last": values[-1],
+            "min": r["vmin"], "max": r["vmax"], "count": r["n"], "unit": r["unit"]}
+
+
+def write(s, cypher, **params):
+    """Run a write in a managed transaction (retried on transient errors,
+    e.g. deadlocks between partition workers on shared nodes)."""
+    s.execute_write(lambda tx: tx.run(cypher, **params).consume())
+    sm.get("kg_upsert").roundtrip("neo4j")
+
+
 def read_ep_ids(path):
     with open(path) as f:
         eps = [ln.strip() for ln in f if ln.strip()]
@@ -28,34 +80,35 @@ def read_ep_ids(path):
     return eps
 
 
-def main(ep_file=None):
-    eps = None
-    if ep_file:
-        eps = read_ep_ids(ep_file)
-        print(f"[i] Filtering by {len(eps)} ep_id(s) from {ep_file}")
+def upsert(eps=None, part=None, mcfg=None, raw_labs=False, lab_batch=500):
+    """Upsert all episodes (or `eps`) of one partition (None = whole tables)."""
+    if mcfg is not None:
+        sm.configure(**mcfg, worker=part)
+    EP, ENC = rel("episodes", part), rel("encounters", part)
+    MED, OBS, PROC = rel("medications", part), rel("observations", part), rel("procedures", part)
 
     drv = GraphDatabase.driver(NEO_URI, auth=NEO_AUTH)
-    with drv.session() as s:
+    with drv.session() as s, sm.profile():
 
         # ---- 1) Patients & Episodes ----
-        sql_ep = """
+        sql_ep = f"""
             SELECT e.patient, e.ep_id, e.t0, e.t1
-            FROM coh.episodes e
+            FROM {EP} e
         """
         params = ()
         if eps:
             sql_ep += " WHERE e.ep_id = ANY(%s) "
             params = (eps,)
-        for r in q(sql_ep, params):
+        for r in timed_rows("episodes", q(sql_ep, params)):
             # MERGE patient
-            s.run("MERGE (p:Patient {id:$pid})", pid=r["patient"])
+            write(s, "MERGE (p:Patient {id:$pid})", pid=r["patient"])
             # MERGE episode (only identifier in MERGE)
-            s.run("""
+            write(s, """
                 MERGE (e:Episode {ep_id:$eid})
                 SET e.t0 = $t0, e.t1 = $t1
             """, eid=r["ep_id"], t0=r["t0"], t1=r["t1"])
             # MERGE relationship without props (then SET)
-            s.run("""
+            write(s, """
                 MATCH (p:Patient {id:$pid}), (e:Episode {ep_id:$eid})
                 MERGE (p)-[rel:HAS_EPISODE]->(e)
             """, pid=r["patient"], eid=r["ep_id"])
@@ -63,10 +116,10 @@ def main(ep_file=None):
         # ---- 2) Encounters ----
         # Link encounters to episodes if the encounter's time window overlaps
         # COALESCE(c.stop, c.start) handles records with null stop times.
-        sql_enc = """
+        sql_enc = f"""
             SELECT c.id, c.patient, c.start, c.stop, e.ep_id
-            FROM coh.encounters c
-            JOIN coh.episodes e
+            FROM {ENC} c
+            JOIN {EP} e
               ON e.patient = c.patient
              AND c.start BETWEEN e.t0 AND e.t1
              AND COALESCE(c.stop, c.start) BETWEEN e.t0 AND e.t1
@@ -75,14 +128,14 @@ def main(ep_file=None):
         if eps:
             sql_enc += " WHERE e.ep_id = ANY(%s) "
             params = (eps,)
-        for r in q(sql_enc, params):
+        for r in timed_rows("encounters", q(sql_enc, params)):
             # MERGE node by id
-            s.run("""
+            write(s, """
                 MERGE (x:Encounter {id:$id})
                 SET x.t0 = $t0, x.t1 = $t1
             """, id=r["id"], t0=r["start"], t1=r["stop"])
             # Link to episode
-            s.run("""
+            write(s, """
                 MATCH (e:Episode {ep_id:$eid}), (x:Encounter {id:$id})
                 MERGE (e)-[rel:HAS_ENCOUNTER]->(x)
                 SET rel.start = $t0, rel.end = $t1
@@ -90,12 +143,12 @@ def main(ep_file=None):
 
         # ---- 3) Medications ----
         # Link medications to episodes if the medication's time window overlaps
-        sql_med = """
+        sql_med = f"""
             SELECT e.ep_id, m.patient, m.start, m.stop,
                    COALESCE(m.description, m.code) AS drug,
                    m.payer
-            FROM coh.medications m
-            JOIN coh.episodes e
+            FROM {MED} m
+            JOIN {EP} e
               ON e.patient = m.patient
              AND m.start BETWEEN e.t0 AND e.t1
              AND COALESCE(m.stop, m.start) BETWEEN e.t0 AND e.t1
@@ -105,28 +158,34 @@ def main(ep_file=None):
         if eps:
             sql_med += " AND e.ep_id = ANY(%s) "
             params = (eps,)
-        for r in q(sql_med, params):
+        for r in timed_rows("medications", q(sql_med, params)):
             # drug identifier may still be empty after COALESCE (unlikely), but guard anyway
             drug = r["drug"]
             if not drug:
                 continue
-            s.run("MERGE (m:Medication {drug:$drug})", drug=drug)
-            s.run("""
+            write(s, "MERGE (m:Medication {drug:$drug})", drug=drug)
+            write(s, """
                 MATCH (e:Episode {ep_id:$eid}), (m:Medication {drug:$drug})
                 MERGE (e)-[rel:RECEIVED]->(m)
                 SET rel.start_ts = $start, rel.end_ts = $stop, rel.payer = $payer
             """, eid=r["ep_id"], drug=drug, start=r["start"], stop=r["stop"], payer=r["payer"])
 
         # ---- 4) Labs (Observations) ----
-        # Skip rows with missing label or ts, and avoid nulls in MERGE
-        sql_lab = """
+        # One HAS_LAB edge per (episode, test) carrying the whole series:
+        # ts/values arrays in time order plus min/max/last/count and unit.
+        # Rows with missing label or ts are skipped (no nulls in MERGE).
+        sql_lab = f"""
             SELECT e.ep_id,
                    o.patient,
-                   o.date                 AS ts,
-                   COALESCE(o.description, o.code) AS label,
-                   o.value, o.units
-            FROM coh.observations o
-            JOIN coh.episodes e
+                   COALESCE(o.description, o.code)  AS label,
+                   array_agg(o.date  ORDER BY o.date) AS ts,
+                   array_agg(o.value ORDER BY o.date) AS vals,
+                   count(*)                          AS n,
+                   min(CASE WHEN btrim(o.value) ~ '{NUMERIC_RE}' THEN btrim(o.value)::float8 END) AS vmin,
+                   max(CASE WHEN btrim(o.value) ~ '{NUMERIC_RE}' THEN btrim(o.value)::float8 END) AS vmax,
+                   max(o.units)                      AS unit
+            FROM {OBS} o
+            JOIN {EP} e
               ON e.patient = o.patient
              AND o.date BETWEEN e.t0 AND e.t1
             WHERE COALESCE(o.description, o.code) IS NOT NULL
@@ -136,38 +195,36 @@ def main(ep_file=None):
         if eps:
             sql_lab += " AND e.ep_id = ANY(%s) "
             params = (eps,)
-        for r in q(sql_lab, params):
-            label = r["label"]
-            ts    = r["ts"]
-            if not label or not ts:
-                continue
-            # MERGE LabTest by label
-            s.run("MERGE (l:LabTest {label:$label})", label=label)
-            # MERGE LabResult by (label, ts) only; then SET optional props
-            s.run("""
-                MERGE (lr:LabResult {label:$label, ts:$ts})
-                SET lr.value = $value, lr.unit = $unit
-            """, label=label, ts=ts,
-                 value=(None if r["value"] is None else str(r["value"])),
-                 unit=r["units"])
-            # Link LabTest -> LabResult and Episode -> LabTest
-            s.run("""
-                MATCH (l:LabTest {label:$label}), (lr:LabResult {label:$label, ts:$ts})
-                MERGE (l)-[r:RESULT]->(lr)
-                SET r.ts = $ts, r.value = $value, r.unit = $unit
-            """, label=label, ts=ts,
-                 value=(None if r["value"] is None else str(r["value"])),
-                 unit=r["units"])
-            s.run("""
-                MATCH (e:Episode {ep_id:$eid}), (l:LabTest {label:$label})
-                MERGE (e)-[:HAS_LAB]->(l)
-            """, eid=r["ep_id"], label=label)
+        sql_lab += " GROUP BY e.ep_id, o.patient, COALESCE(o.description, o.code) "
+        m = sm.get("kg_upsert")
+        for rows in batched((lab_series(r) for r in q(sql_lab, params)), lab_batch):
+            with m.batch("labs", rows=len(rows)):
+                write(s, """
+                    UNWIND $rows AS r
+                    MERGE (l:LabTest {label: r.label})
+                    WITH r, l
+                    MATCH (e:Episode {ep_id: r.ep_id})
+                    MERGE (e)-[h:HAS_LAB]->(l)
+                    SET h.ts = r.ts, h.values = r.values, h.min = r.min, h.max = r.max,
+                        h.last = r.last, h.count = r.count, h.unit = r.unit
+                """, rows=rows)
+                if raw_labs:
+                    # Opt-in per-result nodes, keyed by patient so same-time results don't collide
+                    write(s, """
+                        UNWIND $rows AS r
+                        MATCH (p:Patient {id: r.patient})
+                        UNWIND range(0, size(r.ts) - 1) AS i
+                        MERGE (lr:LabResult {patient: r.patient, label: r.label, ts: r.ts[i]})
+                        SET lr.value = r.raw[i], lr.unit = r.unit
+                        MERGE (p)-[:HAS_RESULT]->(lr)
+                    """, rows=rows)
+            m.report(every=10)
 
         # ---- 5) Procedures ----
-        sql_proc = """
+        sql_proc = f"""
             SELECT e.ep_id, p.patient, p.date AS ts, p.code, p.description
-            FROM coh.procedures p
-            JOIN coh.episodes e
+            FROM {PROC} p
+            JOIN {EP} e
               ON e.patient = p.patient
              AND p.date BETWEEN e.t0 AND e.t1
             WHERE p.code IS NOT NULL
@@ -176,20 +233,60 @@ def main(ep_file=None):
         if eps:
             sql_proc += " AND e.ep_id = ANY(%s) "
             params = (eps,)
-        for r in q(sql_proc, params):
-            s.run("""
+        for r in timed_rows("procedures", q(sql_proc, params)):
+            write(s, """
                 MERGE (pr:Procedure {code:$code})
                 SET pr.name = $name
             """, code=r["code"], name=r["description"])
-            s.run("""
+            write(s, """
                 MATCH (e:Episode {ep_id:$eid}), (pr:Procedure {code:$code})
                 MERGE (e)-[rel:UNDERWENT]->(pr)
                 SET rel.ts = $ts
             """, eid=r["ep_id"], code=r["code"], ts=r["ts"])
 
+    drv.close()
+    sm.get("kg_upsert").report()
+    return part
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("ep_file", nargs="?", default=None,
+                    help="Optional: path to a file containing ep_id (one per line)")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="On the partitioned schema, upsert one partition per worker")
+    ap.add_argument("--raw-labs", action="store_true",
+                    help="Also write one (:Patient)-[:HAS_RESULT]->(:LabResult) node per observation")
+    ap.add_argument("--lab-batch", type=int, default=500,
+                    help="(episode, lab) series per UNWIND write")
+    sm.add_metrics_args(ap)
+    args = ap.parse_args()
+    sm.configure_from_args(args)
+
+    eps = None
+    if args.ep_file:
+        eps = read_ep_ids(args.ep_file)
+        print(f"[i] Filtering by {len(eps)} ep_id(s) from {args.ep_file}")
+
+    parts = []
+    if args.workers > 1:
+        with psycopg2.connect(PG_DSN) as conn:
+            parts = partitions(conn, "episodes")
+        if not parts:
+            print("[i] coh.episodes is not partitioned; running a single worker")
+
+    if parts:
+        print(f"[i] {len(parts)} partition(s) on {args.workers} worker(s)")
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            n = len(parts)
+            for part in ex.map(upsert, [eps] * n, parts, [sm.config()] * n,
+                               [args.raw_labs] * n, [args.lab_batch] * n):
+                print(f"[i] partition {part} done")
+    else:
+        upsert(eps, raw_labs=args.raw_labs, lab_batch=args.lab_batch)
+
     print("KG upsert complete.")
 
 
 if __name__ == "__main__":
-    # Optional: path to a file containing ep_id (one per line)
-    main(sys.argv[1] if len(sys.argv) > 1 else None)
+    main()
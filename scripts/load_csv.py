@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bulk-load the Coherent CSVs into coh.* with parallel COPY.
+
+- tables are loaded largest file first on --workers connections
+- each table is TRUNCATEd and COPYed (FREEZE) in one transaction;
+  partitioned tables (sql/schema_partitioned.sql) are COPYed without
+  FREEZE, which PostgreSQL rejects on a partitioned table
+- idx_* secondary indexes are dropped up front and rebuilt (in parallel)
+  after the load, followed by ANALYZE
+- optional --unlogged skips WAL while loading, then flips tables back
+  (partitioned tables stay logged; SET UNLOGGED does not apply to them);
+  every run, even a failed one, re-enables triggers and SET LOGGEDs any
+  of the tables a previous run left unlogged
+- progress is recorded in coh._load_state so a re-run only loads the
+  tables that did not finish (use --restart to load everything again)
+
+  python scripts/load_csv.py --csv-dir coherent/csv --workers 6 --unlogged
+"""
+
+import os, time, argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import psycopg2
+
+DEFAULT_DSN = os.environ.get(
+    "PG_DSN",
+    "host=localhost dbname=synthea user=mimic password=strong_password"
+)
+
+# table name == CSV basename (see sql/schema.sql for column order)
+TABLES = [
+    "patients", "encounters", "conditions", "medications", "observations",
+    "procedures", "allergies", "careplans", "devices", "imaging_studies",
+    "immunizations", "organizations", "payer_transitions", "payers",
+    "providers", "supplies",
+]
+
+
+# ---------- bookkeeping ----------
+def ensure_state(conn, restart):
+    with conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS coh._load_state(
+          tbl       TEXT PRIMARY KEY,
+          rows      BIGINT,
+          seconds   DOUBLE PRECISION,
+          loaded_at TIMESTAMPTZ DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS coh._deferred_indexes(
+          name TEXT PRIMARY KEY,
+          tbl  TEXT,
+          def  TEXT
+        );
+        """)
+        if restart:
+            cur.execute("TRUNCATE coh._load_state")
+    conn.commit()
+
+
+def loaded_tables(conn):
+    """Tables recorded as done that still hold rows (unlogged tables are emptied by a crash)."""
+    done = set()
+    with conn.cursor() as cur:
+        cur.execute("SELECT tbl, rows FROM coh._load_state")
+        for tbl, rows in cur.fetchall():
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM coh.{tbl})")
+            if rows == 0 or cur.fetchone()[0]:
+                done.add(tbl)
+            else:
+                print(f"[!] coh.{tbl} is recorded as loaded but empty; reloading")
+    return done
+
+
+def relkinds(conn, tables):
+    """{table: pg_class.relkind} for coh.<table> ('r' plain, 'p' partitioned)."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname, c.relkind FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'coh' AND c.relname = ANY(%s)
+        """, (list(tables),))
+        kinds = dict(cur.fetchall())
+    conn.commit()
+    return kinds
+
+
+def defer_indexes(conn, tables):
+    """Remember and drop the idx_* indexes on `tables` (dropping a partitioned
+    parent's index drops its partitions' indexes too; build_index restores both)."""
+    with conn.cursor() as cur:
+        cur.execute(r"""
+            SELECT indexname, tablename, indexdef FROM pg_indexes
+            WHERE schemaname = 'coh' AND tablename = ANY(%s) AND indexname LIKE 'idx\_%%'
+        """, (list(tables),))
+        found = cur.fetchall()
+        for name, tbl, idef in found:
+            cur.execute("""
+                INSERT INTO coh._deferred_indexes(name, tbl, def) VALUES (%s,%s,%s)
+                ON CONFLICT (name) DO NOTHING
+            """, (name, tbl, idef))
+            cur.execute(f"DROP INDEX IF EXISTS coh.{name}")
+    conn.commit()
+    return [f[0] for f in found]
+
+
+def set_logged(conn, tables, logged):
+    with conn.cursor() as cur:
+        for t in tables:
+            cur.execute(f"ALTER TABLE coh.{t} SET {'LOGGED' if logged else 'UNLOGGED'}")
+    conn.commit()
+
+
+def set_user_triggers(conn, tables, enabled):
+    # e.g. the episodes dirty-queue triggers on coh.encounters; a bulk load
+    # is followed by a full `refresh_episodes.py --all` instead.
+    with conn.cursor() as cur:
+        for t in tables:
+            cur.execute(f"ALTER TABLE coh.{t} {'ENABLE' if enabled else 'DISABLE'} TRIGGER USER")
+    conn.commit()
+
+
+def restore_tables(conn, tables):
+    """Re-enable user triggers and SET LOGGED on every coh.<table> in `tables`
+    that a run (this one or an interrupted earlier one) left changed."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname, c.relpersistence FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'coh' AND c.relname = ANY(%s) AND c.relkind IN ('r', 'p')
+        """, (list(tables),))
+        persistence = dict(cur.fetchall())
+    conn.commit()
+    set_user_triggers(conn, [t for t in tables if t in persistence], enabled=True)
+    unlogged = [t for t in tables if persistence.get(t) == "u"]
+    if unlogged:
+        t = time.time()
+        set_logged(conn, unlogged, logged=True)
+        print(f"[i] SET LOGGED {', '.join(unlogged)} in {time.time() - t:.1f}s")
+
+
+# ---------- workers ----------
+def copy_table(dsn, tbl, path, freeze=True):
+    t0 = time.time()
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur, open(path, "r", encoding="utf-8") as f:
+            cur.execute(f"TRUNCATE coh.{tbl}")
+            opts = "FORMAT csv, HEADER true" + (", FREEZE true" if freeze else "")
+            cur.copy_expert(f"COPY coh.{tbl} FROM STDIN WITH ({opts})", f, size=1 << 20)
+            rows = cur.rowcount
+            secs = time.time() - t0
+            cur.execute("""
+                INSERT INTO coh._load_state(tbl, rows, seconds) VALUES (%s,%s,%s)
+                ON CONFLICT (tbl) DO UPDATE
+                SET rows = EXCLUDED.rows, seconds = EXCLUDED.seconds, loaded_at = now()
+            """, (tbl, rows, secs))
+        conn.commit()
+    finally:
+        conn.close()
+    return tbl, rows, secs
+
+
+def build_index(dsn, name, idef, maintenance_work_mem):
+    t0 = time.time()
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET maintenance_work_mem = %s", (maintenance_work_mem,))
+            # pg_indexes shows a partitioned parent's index as `ON ONLY coh.<tbl>`;
+            # replayed as-is that builds an invalid parent index and no partition
+            # indexes, so rebuild it on the whole hierarchy instead.
+            idef = idef.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1)
+            cur.execute(idef.replace(" ON ONLY ", " ON ", 1))
+            cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = %s::regclass",
+                        (f"coh.{name}",))
+            if not cur.fetchone()[0]:
+                raise RuntimeError(f"index coh.{name} was rebuilt but is not valid: {idef}")
+            cur.execute("DELETE FROM coh._deferred_indexes WHERE name = %s", (name,))
+        conn.commit()
+    finally:
+        conn.close()
+    return name, time.time() - t0
+
+
+def analyze_table(dsn, tbl):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"ANALYZE coh.{tbl}")
+    finally:
+        conn.close()
+    return tbl
+
+
+# ---------- main ----------
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--csv-dir", default="coherent/csv", help="Directory with the Coherent CSVs")
+    ap.add_argument("--dsn", default=DEFAULT_DSN, help="Postgres DSN")
+    ap.add_argument("--workers", type=int, default=4, help="Parallel COPY connections")
+    ap.add_argument("--tables", default=None,
+                    help="Comma-separated subset of tables (default: all Coherent tables)")
+    ap.add_argument("--unlogged", action="store_true",
+                    help="Load into UNLOGGED tables and SET LOGGED afterwards")
+    ap.add_argument("--maintenance-work-mem", default="1GB",
+                    help="maintenance_work_mem for index builds")
+    ap.add_argument("--restart", action="store_true",
+                    help="Ignore coh._load_state and reload every table")
+    args = ap.parse_args()
+
+    tables = args.tables.split(",") if args.tables else TABLES
+    jobs = []
+    for t in tables:
+        path = os.path.join(args.csv_dir, f"{t}.csv")
+        if not os.path.exists(path):
+            print(f"[!] {path} not found; skipping coh.{t}")
+            continue
+        jobs.append((os.path.getsize(path), t, path))
+    jobs.sort(reverse=True)   # largest first so the long poles start early
+
+    conn = psycopg2.connect(args.dsn)
+    ensure_state(conn, args.restart)
+    done = loaded_tables(conn)
+    todo = [(size, t, p) for size, t, p in jobs if t not in done]
+    if done:
+        print(f"[i] Resuming; already loaded: {', '.join(sorted(done & set(tables)))}")
+    todo_tables = [t for _, t, _ in todo]
+
+    kinds = relkinds(conn, todo_tables)
+    partitioned = {t for t in todo_tables if kinds.get(t) == "p"}
+    # SET [UN]LOGGED only applies to plain tables
+    plain = [t for t in todo_tables if t not in partitioned]
+
+    t_start = time.time()
+    if todo:
+        if partitioned:
+            print(f"[i] Partitioned (COPY without FREEZE{', stay logged' if args.unlogged else ''}): "
+                  f"{', '.join(sorted(partitioned))}")
+        dropped = defer_indexes(conn, todo_tables)
+        if dropped:
+            print(f"[i] Deferred {len(dropped)} index(es): {', '.join(dropped)}")
+        set_user_triggers(conn, todo_tables, enabled=False)
+        if args.unlogged:
+            set_logged(conn, plain, logged=False)
+
+        try:
+            total_rows = 0
+            with ProcessPoolExecutor(max_workers=args.workers) as ex:
+                futs = [ex.submit(copy_table, args.dsn, t, p, t not in partitioned)
+                        for _, t, p in todo]
+                for fut in as_completed(futs):
+                    tbl, rows, secs = fut.result()
+                    total_rows += rows
+                    print(f"[copy] coh.{tbl:<18} {rows:>12,} rows  {secs:8.1f}s  "
+                          f"{rows / max(secs, 1e-6):>12,.0f} rows/s")
+            print(f"[copy] {total_rows:,} rows in {time.time() - t_start:.1f}s")
+        finally:
+            restore_tables(conn, tables)
+    else:
+        restore_tables(conn, tables)   # an interrupted run may have left tables unlogged
+
+    # rebuild every deferred index (including ones left over from an interrupted run)
+    with conn.cursor() as cur:
+        cur.execute("SELECT name, def FROM coh._deferred_indexes ORDER BY name")
+        pending = cur.fetchall()
+    conn.commit()
+    if pending:
+        t = time.time()
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            futs = [ex.submit(build_index, args.dsn, n, d, args.maintenance_work_mem)
+                    for n, d in pending]
+            for fut in as_completed(futs):
+                name, secs = fut.result()
+                print(f"[index] {name} {secs:.1f}s")
+        print(f"[index] {len(pending)} index(es) in {time.time() - t:.1f}s")
+
+    if todo:
+        t = time.time()
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            list(ex.map(analyze_table, [args.dsn] * len(todo_tables), todo_tables))
+        print(f"[analyze] {len(todo_tables)} table(s) in {time.time() - t:.1f}s")
+        if "encounters" in todo_tables:
+            print("[i] encounters reloaded; rebuild episodes with "
+                  "`python scripts/refresh_episodes.py --all`")
+    conn.close()
+    print(f"[done] {time.time() - t_start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Helpers for the optional hash-partitioned schema (sql/schema_partitioned.sql).
+
+Partition k of every coh.* table is coh.<table>_p<k> and holds the same
+patients, so a worker that owns partition k can join
+coh.episodes_p<k> with coh.observations_p<k> without touching the rest.
+On the plain schema there are no partitions and jobs run as before.
+"""
+
+import re
+
+
+def partitions(conn, table):
+    """Remainders k of coh.<table>_p<k>, sorted; [] if coh.<table> is not partitioned."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+        """, (f"coh.{table}",))
+        names = [r[0] for r in cur.fetchall()]
+    conn.commit()
+    ks = []
+    for n in names:
+        m = re.fullmatch(rf"{re.escape(table)}_p(\d+)", n)
+        if m:
+            ks.append(int(m.group(1)))
+    return sorted(ks)
+
+
+def rel(table, part=None):
+    """Qualified name of coh.<table>, or of its partition `part`."""
+    return f"coh.{table}" if part is None else f"coh.{table}_p{part}"
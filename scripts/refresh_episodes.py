@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incrementally maintain coh.episodes.
+
+Only patients whose encounters changed (queued in coh.episodes_dirty by the
+triggers on coh.encounters) are re-segmented with coh.segment_episodes().
+The old and new episode rows of those patients are diffed, and the ep_ids
+that were added / removed / changed are written to a JSON delta so the
+episode_notes, Qdrant and Neo4j stages can update just those episodes.
+
+  python scripts/refresh_episodes.py                 # drain the dirty queue
+  python scripts/refresh_episodes.py --all           # re-segment everyone
+  python scripts/refresh_episodes.py --patients-file pats.txt
+  python scripts/refresh_episodes.py --all --workers 8   # one partition per worker
+"""
+
+import os, json, time, argparse
+from concurrent.futures import ProcessPoolExecutor
+import psycopg2
+from partitions import partitions
+
+DEFAULT_DSN = os.environ.get(
+    "PG_DSN",
+    "host=localhost dbname=synthea user=mimic password=strong_password"
+)
+
+
+# ---------- patient selection ----------
+def dirty_patients(conn):
+    """Return (patients, high_water_id) for the current dirty queue."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM coh.episodes_dirty")
+        hwm = cur.fetchone()[0]
+        cur.execute("""
+            SELECT DISTINCT patient FROM coh.episodes_dirty
+            WHERE id <= %s ORDER BY patient
+        """, (hwm,))
+        return [r[0] for r in cur.fetchall()], hwm
+
+
+def all_patients(conn):
+    # Patients that lost all their encounters still need their episodes removed.
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM coh.episodes_dirty")
+        hwm = cur.fetchone()[0]
+        cur.execute("""
+            SELECT patient FROM coh.encounters WHERE patient IS NOT NULL
+            UNION
+            SELECT patient FROM coh.episodes
+            ORDER BY 1
+        """)
+        return [r[0] for r in cur.fetchall()], hwm
+
+
+def read_patients(path):
+    with open(path) as f:
+        return sorted({ln.strip() for ln in f if ln.strip()})
+
+
+# ---------- re-segmentation ----------
+def resegment(conn, patients):
+    """
+    Re-segment `patients` in one transaction and apply the diff to coh.episodes.
+    Returns (added, removed, changed) ep_id lists.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE _ep_new ON COMMIT DROP AS
+            SELECT * FROM coh.segment_episodes(%s::text[])
+        """, (patients,))
+        cur.execute("""
+            DELETE FROM coh.episodes o
+            WHERE o.patient = ANY(%s)
+              AND NOT EXISTS (SELECT 1 FROM _ep_new n WHERE n.ep_id = o.ep_id)
+            RETURNING o.ep_id
+        """, (patients,))
+        removed = [r[0] for r in cur.fetchall()]
+        cur.execute("""
+            UPDATE coh.episodes o
+            SET t0 = n.t0, t1 = n.t1, n_enc = n.n_enc
+            FROM _ep_new n
+            WHERE o.patient = n.patient AND o.ep_id = n.ep_id
+              AND (o.t0, o.t1, o.n_enc) IS DISTINCT FROM (n.t0, n.t1, n.n_enc)
+            RETURNING o.ep_id
+        """)
+        changed = [r[0] for r in cur.fetchall()]
+        cur.execute("""
+            INSERT INTO coh.episodes(patient, t0, t1, n_enc, ep_id)
+            SELECT n.patient, n.t0, n.t1, n.n_enc, n.ep_id
+            FROM _ep_new n
+            WHERE NOT EXISTS (SELECT 1 FROM coh.episodes o
+                              WHERE o.patient = n.patient AND o.ep_id = n.ep_id)
+            RETURNING ep_id
+        """)
+        added = [r[0] for r in cur.fetchall()]
+    return added, removed, changed
+
+
+def clear_dirty(conn, patients, hwm):
+    with conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM coh.episodes_dirty
+            WHERE id <= %s AND patient = ANY(%s)
+        """, (hwm, patients))
+
+
+def refresh_group(dsn, patients, hwm, batch, label=""):
+    """Re-segment `patients` in transactions of `batch` patients."""
+    conn = psycopg2.connect(dsn)
+    added, removed, changed = [], [], []
+    for i in range(0, len(patients), batch):
+        chunk = patients[i:i + batch]
+        a, r, c = resegment(conn, chunk)
+        if hwm:
+            clear_dirty(conn, chunk, hwm)
+        conn.commit()
+        added += a; removed += r; changed += c
+        print(f"{label}[{min(i + batch, len(patients))}/{len(patients)}] "
+              f"+{len(added)} -{len(removed)} ~{len(changed)} episodes")
+    conn.close()
+    return added, removed, changed
+
+
+def patient_groups(conn, patients, workers):
+    """
+    Split patients for parallel workers: by hash partition of coh.encounters
+    on the partitioned schema (each worker then only touches its own
+    encounters_p<k> / episodes_p<k>), otherwise into `workers` stripes.
+    """
+    parts = partitions(conn, "encounters")
+    if not parts:
+        return [patients[i::workers] for i in range(workers)]
+    groups = []
+    with conn.cursor() as cur:
+        for k in parts:
+            cur.execute("""
+                SELECT p FROM unnest(%s::text[]) p
+                WHERE satisfies_hash_partition('coh.encounters'::regclass, %s, %s, p)
+                ORDER BY p
+            """, (patients, len(parts), k))
+            groups.append([r[0] for r in cur.fetchall()])
+    conn.commit()
+    return groups
+
+
+# ---------- main ----------
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dsn", default=DEFAULT_DSN, help="Postgres DSN")
+    ap.add_argument("--all", action="store_true",
+                    help="Re-segment every patient (initial build / after TRUNCATE)")
+    ap.add_argument("--patients-file", default=None,
+                    help="Re-segment only these patients (one id per line)")
+    ap.add_argument("--batch", type=int, default=5000,
+                    help="Patients re-segmented per transaction")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Parallel workers (one hash partition each on the partitioned schema)")
+    ap.add_argument("--delta-out", default="episodes_delta.json",
+                    help="Where to write the added/removed/changed ep_id delta")
+    ap.add_argument("--ep-list-out", default=None,
+                    help="Optional file of added+changed ep_ids (one per line), "
+                         "usable as --episodes-file / ep_id file downstream")
+    args = ap.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    if args.all:
+        patients, hwm = all_patients(conn)
+    elif args.patients_file:
+        patients, hwm = read_patients(args.patients_file), 0
+    else:
+        patients, hwm = dirty_patients(conn)
+    conn.commit()
+    print(f"[i] Re-segmenting {len(patients)} patient(s)")
+
+    t0 = time.time()
+    added, removed, changed = [], [], []
+    if args.workers > 1 and patients:
+        groups = [g for g in patient_groups(conn, patients, args.workers) if g]
+        conn.close()
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            futs = [ex.submit(refresh_group, args.dsn, g, hwm, args.batch, f"(group {k}) ")
+                    for k, g in enumerate(groups)]
+            for fut in futs:
+                a, r, c = fut.result()
+                added += a; removed += r; changed += c
+    else:
+        conn.close()
+        added, removed, changed = refresh_group(args.dsn, patients, hwm, args.batch)
+
+    delta = {
+        "patients": patients,
+        "added": sorted(added),
+        "removed": sorted(removed),
+        "changed": sorted(changed),
+    }
+    with open(args.delta_out, "w") as f:
+        json.dump(delta, f)
+    if args.ep_list_out:
+        with open(args.ep_list_out, "w") as f:
+            for ep in sorted(added + changed):
+                f.write(ep + "\n")
+
+    print(f"[done] +{len(added)} -{len(removed)} ~{len(changed)} episodes "
+          f"in {time.time() - t0:.1f}s → {args.delta_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bulk-load embedding shards (written by the indexers with --shard-dir)
+into a Qdrant collection or a local store, with no re-encoding.
+
+Qdrant: one process per shard (--workers), each upserting --batch points
+per request. Local stores have a single writer, so shards load in order.
+
+  python scripts/restore_shards.py shards/e5-base --collection notes_chunks --workers 8
+  python scripts/restore_shards.py shards/e5-base --collection notes_chunks --qdrant-url http://replica:6333
+  python scripts/restore_shards.py shards/e5-base --collection notes_chunks_dev --backend local
+"""
+
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import stage_metrics as sm
+import vector_store as vs
+from embedding_shards import read_manifest, load_shard
+
+
+def restore_shard(root, name, store_kw, batch, mcfg=None, store=None):
+    """Upsert one shard; returns (name, rows, secs)."""
+    if mcfg is not None:
+        sm.configure(**mcfg)
+    t0 = time.time()
+    if store is None:
+        store = vs.open_store(**store_kw)
+    m = sm.get("restore")
+    ids, vecs, payloads = load_shard(root, name)
+    for i in range(0, len(ids), batch):
+        with m.batch("upsert", rows=len(ids[i:i + batch])):
+            store.upsert(ids[i:i + batch], vecs[i:i + batch], payloads[i:i + batch])
+        m.roundtrip(store.backend)
+    return name, len(ids), time.time() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("shard_dir", help="Directory with manifest*.json and shard files")
+    ap.add_argument("--collection", default="notes_chunks", help="Target collection / local store name")
+    ap.add_argument("--qdrant-url", default=vs.DEFAULT_QURL, help="Qdrant URL")
+    vs.add_store_args(ap)
+    ap.add_argument("--workers", type=int, default=4, help="Parallel shard uploads (Qdrant)")
+    ap.add_argument("--batch", type=int, default=1024, help="Points per upsert request")
+    ap.add_argument("--append", action="store_true",
+                    help="Keep existing points (default: recreate the collection)")
+    sm.add_metrics_args(ap)
+    args = ap.parse_args()
+    sm.configure_from_args(args)
+
+    man = read_manifest(args.shard_dir)
+    total = sum(s["rows"] for s in man["shards"])
+    print(f"[i] {len(man['shards'])} shard(s), {total} vectors | model={man['model']} dim={man['dim']} "
+          f"→ {args.collection} ({args.backend})")
+
+    store_kw = {"backend": args.backend, "name": args.collection, "url": args.qdrant_url,
+                "path": args.store_dir, "dtype": args.store_dtype}
+    store = vs.open_store(**store_kw)
+    store.ensure(man["dim"], recreate=not args.append)
+
+    m = sm.get("restore")
+    t0 = time.time()
+    done = 0
+    with sm.profile():
+        if args.backend == "local" or args.workers <= 1:
+            for s in man["shards"]:
+                _, n, secs = restore_shard(args.shard_dir, s["name"], store_kw, args.batch, store=store)
+                done += n
+                m.report(total, extra=f"{s['name']} {secs:.1f}s")
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers) as ex:
+                futs = [ex.submit(restore_shard, args.shard_dir, s["name"], store_kw, args.batch,
+                                  {**sm.config(), "worker": k})
+                        for k, s in enumerate(man["shards"])]
+                for fut in as_completed(futs):
+                    name, n, secs = fut.result()
+                    done += n
+                    m.add_rows(n)
+                    m.report(total, extra=f"{name} {secs:.1f}s")
+    store.close()
+    print(f"[done] restored {done}/{total} vectors in {time.time() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared instrumentation for the pipeline stages (extraction, indexing,
+KG upsert, retrieval, generation).
+
+Per stage it tracks rows and rows/s, batch latency histograms per
+operation, queue depth, DB round trips and peak RSS, and writes them to
+a Prometheus textfile (*.prom, for node_exporter's textfile collector)
+or appends JSONL snapshots (any other path). An optional cProfile dump of
+the hot loop (*.pstats; view with snakeviz / `python -m pstats`, or
+attach py-spy to the same process) is written on exit. Pool workers that
+configure() from sm.config() flush on their own when they exit.
+
+  import stage_metrics as sm
+  sm.add_metrics_args(ap); args = ap.parse_args(); sm.configure_from_args(args)
+  m = sm.get("indexing")
+  with sm.profile():
+      for batch in ...:
+          with m.batch("encode"): ...
+          with m.batch("upsert", rows=len(batch)): ...; m.roundtrip("qdrant")
+          m.report(total)
+"""
+
+import os, sys, json, time, atexit, cProfile, resource, threading
+import multiprocessing, multiprocessing.util
+from contextlib import contextmanager
+
+# Prometheus-style latency buckets (seconds)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_config = {"out": None, "every": 30.0, "profile": None, "labels": {}}
+_registry = {}
+_lock = threading.Lock()
+_last_flush = [0.0]
+_exit_hook = [False]
+
+
+def peak_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024   # Linux reports KiB
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.n = 0
+        self.samples = []   # bounded reservoir for percentiles
+
+    def observe(self, secs):
+        i = 0
+        while i < len(BUCKETS) and secs > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += secs
+        self.n += 1
+        if len(self.samples) < 10000:
+            self.samples.append(secs)
+        else:
+            self.samples[self.n % 10000] = secs
+
+    def quantile(self, q):
+        if not self.samples:
+            return 0.0
+        s = sorted(self.samples)
+        return s[min(len(s) - 1, int(q * len(s)))]
+
+
+class StageMetrics:
+    def __init__(self, stage):
+        self.stage = stage
+        self.t0 = time.time()
+        self.rows = 0
+        self.hist = {}
+        self.roundtrips = {}
+        self.queue = 0
+        self.queue_max = 0
+        self._last_report = 0.0
+
+    # ---- recording ----
+    def add_rows(self, n):
+        self.rows += n
+
+    def observe(self, op, secs, rows=0):
+        with _lock:
+            self.hist.setdefault(op, Histogram()).observe(secs)
+            self.rows += rows
+        _maybe_flush()
+
+    @contextmanager
+    def batch(self, op="batch", rows=0):
+        """Time one batch of `op`; `rows` are counted towards the stage throughput."""
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(op, time.perf_counter() - t, rows)
+
+    def roundtrip(self, db="db", n=1):
+        self.roundtrips[db] = self.roundtrips.get(db, 0) + n
+
+    def queue_depth(self, n):
+        self.queue = n
+        self.queue_max = max(self.queue_max, n)
+
+    # ---- reporting ----
+    def elapsed(self):
+        return time.time() - self.t0
+
+    def rate(self):
+        return self.rows / max(self.elapsed(), 1e-6)
+
+    def report(self, total=None, every=0.0, extra=""):
+        """One uniform progress line: [stage] rows[/total] rate, p50/p95 per op, rss."""
+        now = time.time()
+        if every and now - self._last_report < every:
+            return
+        self._last_report = now
+        done = f"{self.rows}/{total}" if total else f"{self.rows}"
+        eta = ""
+        if total and self.rows:
+            eta = f"  ETA ~{max(total - self.rows, 0) / self.rate() / 60:.1f} min"
+        lat = "  ".join(f"{op} p50={h.quantile(.5) * 1e3:.0f}ms p95={h.quantile(.95) * 1e3:.0f}ms"
+                        for op, h in self.hist.items())
+        print(f"[{self.stage}] {done} rows  {self.rate():.1f} rows/s{eta}  {lat}  "
+              f"rss={peak_rss_bytes() / 2**20:.0f}MB{('  ' + extra) if extra else ''}")
+
+    def snapshot(self):
+        return {
+            "stage": self.stage, "time": time.time(), **_config["labels"],
+            "rows": self.rows, "elapsed_s": round(self.elapsed(), 3),
+            "rows_per_s": round(self.rate(), 3),
+            "batches": {op: {"count": h.n, "sum_s": round(h.sum, 6),
+                             "p50_s": h.quantile(.5), "p95_s": h.quantile(.95),
+                             "p99_s": h.quantile(.99)}
+                        for op, h in self.hist.items()},
+            "db_roundtrips": dict(self.roundtrips),
+            "queue_depth": self.queue, "queue_depth_max": self.queue_max,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+    def prometheus(self):
+        lbl = {"stage": self.stage, **_config["labels"]}
+        def fmt(extra=None):
+            d = {**lbl, **(extra or {})}
+            return "{" + ",".join(f'{k}="{v}"' for k, v in d.items()) + "}"
+        out = [f"ehr_rows_total{fmt()} {self.rows}",
+               f"ehr_rows_per_second{fmt()} {self.rate():.3f}",
+               f"ehr_elapsed_seconds{fmt()} {self.elapsed():.3f}",
+               f"ehr_queue_depth{fmt()} {self.queue}",
+               f"ehr_queue_depth_max{fmt()} {self.queue_max}"]
+        for db, n in self.roundtrips.items():
+            out.append(f"ehr_db_roundtrips_total{fmt({'db': db})} {n}")
+        for op, h in self.hist.items():
+            cum = 0
+            for le, c in zip(BUCKETS + ("+Inf",), h.counts):
+                cum += c
+                out.append(f"ehr_batch_seconds_bucket{fmt({'op': op, 'le': le})} {cum}")
+            out.append(f"ehr_batch_seconds_sum{fmt({'op': op})} {h.sum:.6f}")
+            out.append(f"ehr_batch_seconds_count{fmt({'op': op})} {h.n}")
+        return out
+
+
+# ---------- registry / output ----------
+def get(stage):
+    with _lock:
+        m = _registry.get(stage)
+        if m is None:
+            m = _registry[stage] = StageMetrics(stage)
+        return m
+
+
+def _out_path(path):
+    w = _config["labels"].get("worker")
+    if w is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{w}{ext}"
+
+
+def flush():
+    """Write all stages now (Prometheus textfile is replaced atomically)."""
+    path = _config["out"]
+    _last_flush[0] = time.time()
+    if not path or not _registry:
+        return
+    path = _out_path(path)
+    stages = list(_registry.values())
+    if path.endswith(".prom"):
+        lines = ["# TYPE ehr_rows_total counter", "# TYPE ehr_batch_seconds histogram",
+                 "# TYPE ehr_db_roundtrips_total counter", "# TYPE ehr_peak_rss_bytes gauge"]
+        for m in stages:
+            lines += m.prometheus()
+        wl = "".join(f',{k}="{v}"' for k, v in _config["labels"].items())
+        lines.append(f'ehr_peak_rss_bytes{{pid="{os.getpid()}"{wl}}} {peak_rss_bytes()}')
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+    else:
+        with open(path, "a") as f:
+            for m in stages:
+                f.write(json.dumps(m.snapshot()) + "\n")
+
+
+def _maybe_flush():
+    if _config["out"] and time.time() - _last_flush[0] >= _config["every"]:
+        flush()
+
+
+def configure(out=None, every=30.0, profile=None, **labels):
+    labels = {k: v for k, v in labels.items() if v is not None}
+    if _exit_hook[0] and labels != _config["labels"] and _registry:
+        # a pool worker picked up a task with other labels: close out the last one
+        flush()
+        _registry.clear()
+    _config.update(out=out, every=every, profile=profile, labels=labels)
+    if not _exit_hook[0] and multiprocessing.parent_process() is not None:
+        # pool workers exit without running atexit hooks, but do run these
+        multiprocessing.util.Finalize(None, flush, exitpriority=0)
+        _exit_hook[0] = True
+
+
+def config():
+    """Current settings, to hand to configure() in worker processes."""
+    return {"out": _config["out"], "every": _config["every"],
+            "profile": _config["profile"], **_config["labels"]}
+
+
+def add_metrics_args(ap):
+    ap.add_argument("--metrics-out", default=os.environ.get("METRICS_OUT"),
+                    help="Write stage metrics: *.prom = Prometheus textfile, else JSONL")
+    ap.add_argument("--metrics-every", type=float, default=30.0,
+                    help="Seconds between metric flushes")
+    ap.add_argument("--profile", default=None,
+                    help="Write a cProfile dump of the hot loop to this path (*.pstats)")
+
+
+def configure_from_args(args, **labels):
+    configure(args.metrics_out, args.metrics_every, args.profile, **labels)
+
+
+@contextmanager
+def profile():
+    """cProfile the enclosed block if --profile was given."""
+    path = _config["profile"]
+    if not path:
+        yield
+        return
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        prof.dump_stats(_out_path(path))
+
+
+def timed(stage, op, rows=0):
+    """Decorator: time each call of the function as one `op` batch of `stage`."""
+    def deco(fn):
+        def wrapper(*a, **kw):
+            with get(stage).batch(op, rows=rows):
+                return fn(*a, **kw)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+    return deco
+
+
+atexit.register(flush)
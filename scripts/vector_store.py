@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vector store backends shared by the indexers, rag/summarize.py and the benchmark.
+
+  import vector_store as vs
+  store = vs.open_store("local", "notes_chunks_dev")   # or "qdrant"; default $VECTOR_BACKEND
+  store.ensure(dim, recreate=True)                        # or store.exists()
+  store.upsert([vs.point_id(n["id"], n["ep_id"]) for n in notes], vectors, notes)
+  store.close()
+  hits = store.search(query_vector, limit=10, ep_id=ep)  # [Hit(id, score, payload)]
+
+Backends:
+  qdrant  a Qdrant collection (url ":memory:" for an in-process instance)
+  local   an embedded store under <dir>/<name>/, no service needed:
+            vectors.bin    float32 or int8 row matrix, opened with np.memmap
+            payloads.jsonl one {"id", "payload"} line per row (+ offsets.npy)
+            ep_index.json  ep_id → [start, stop) row range
+            ids.json, meta.json
+          Rows are kept grouped by ep_id (the indexers stream ORDER BY ep_id),
+          so an ep_id-filtered search is one matmul over a contiguous slice.
+          Vectors are L2-normalized; scores are cosine similarities. A store
+          has a single writer; close() dedupes ids (last write wins) and
+          regroups rows if an append broke the ep_id grouping.
+"""
+
+import os, json, mmap, uuid, shutil
+from collections import namedtuple
+
+DEFAULT_BACKEND = os.environ.get("VECTOR_BACKEND", "qdrant")
+DEFAULT_QURL = os.environ.get("QDRANT_URL", "http://localhost:6333")
+DEFAULT_DIR = os.environ.get("VECTOR_DIR", "vectors")
+
+Hit = namedtuple("Hit", "id score payload")
+
+# Fixed namespace: point ids must stay identical across runs, shards and replicas
+POINT_NS = uuid.UUID("5f1d7c1e-3a0b-5c62-9a4e-6f0f7e1c2b3d")
+
+
+def point_id(note_id, ep_id):
+    """Stable point id of a note within an episode (a note can fall into
+    several overlapping episodes, so note_id alone is not unique)."""
+    return str(uuid.uuid5(POINT_NS, f"{note_id}:{ep_id}"))
+
+
+INT8_SCALE = 127.0
+CHUNK = 65536
+
+
+# ---------- qdrant ----------
+class QdrantStore:
+    backend = "qdrant"
+
+    def __init__(self, name, url=None, timeout=60):
+        from qdrant_client import QdrantClient
+        self.name = name
+        url = url or DEFAULT_QURL
+        if url == ":memory:":
+            self.client = QdrantClient(":memory:")
+        else:
+            self.client = QdrantClient(url, timeout=timeout, check_compatibility=False)
+
+    def exists(self):
+        return self.client.collection_exists(self.name)
+
+    def ensure(self, dim, recreate=False):
+        from qdrant_client.http.models import VectorParams, Distance
+        # Avoid deprecated get_collection kwargs; use collection_exists
+        if recreate and self.client.collection_exists(self.name):
+            self.client.delete_collection(self.name)
+        if not self.client.collection_exists(self.name):
+            self.client.create_collection(
+                collection_name=self.name,
+                vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+            )
+
+    def upsert(self, ids, vectors, payloads):
+        import numpy as np
+        from qdrant_client.http.models import PointStruct
+        vectors = np.asarray(vectors, dtype=np.float32).tolist()   # one C pass, not per-float
+        points = [PointStruct(id=i, vector=v, payload=p)
+                  for i, v, p in zip(ids, vectors, payloads)]
+        self.client.upsert(self.name, points=points)
+
+    def search(self, vector, limit=10, ep_id=None):
+        import numpy as np
+        from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+        flt = None
+        if ep_id is not None:
+            flt = Filter(must=[FieldCondition(key="ep_id", match=MatchValue(value=ep_id))])
+        hits = self.client.search(collection_name=self.name, query_vector=np.asarray(vector, dtype=np.float32).ravel().tolist(),
+                                  limit=limit, query_filter=flt)
+        return [Hit(h.id, h.score, h.payload) for h in hits]
+
+    def close(self):
+        pass
+
+
+# ---------- embedded ----------
+def _write_json(path, obj):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+class LocalStore:
+    backend = "local"
+
+    def __init__(self, name, path=None, dtype="float32"):
+        import numpy as np
+        self.np = np
+        self.name = name
+        self.dir = os.path.join(path or DEFAULT_DIR, name)
+        self.dtype = dtype
+        self._w = None
+        self._load()
+
+    def _p(self, fn):
+        return os.path.join(self.dir, fn)
+
+    def _load(self):
+        np = self.np
+        self._vecs = self._pay = self._payf = None
+        if not os.path.exists(self._p("meta.json")):
+            self.meta, self._index = None, {}
+            return
+        with open(self._p("meta.json")) as f:
+            self.meta = json.load(f)
+        with open(self._p("ep_index.json")) as f:
+            self._index = json.load(f)
+        n, dim = self.meta["n"], self.meta["dim"]
+        self._offsets = np.load(self._p("offsets.npy"), mmap_mode="r")
+        if n:
+            self._vecs = np.memmap(self._p("vectors.bin"), dtype=self.meta["dtype"], mode="r", shape=(n, dim))
+            self._payf = open(self._p("payloads.jsonl"), "rb")
+            self._pay = mmap.mmap(self._payf.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.meta["n"] if self.meta else 0
+
+    def exists(self):
+        return self.meta is not None
+
+    # ---- writing ----
+    def ensure(self, dim, recreate=False):
+        if recreate and os.path.isdir(self.dir):
+            self._release()
+            shutil.rmtree(self.dir)
+            self._load()
+        if self.meta is None:
+            os.makedirs(self.dir, exist_ok=True)
+            for fn in ("vectors.bin", "payloads.jsonl"):
+                open(self._p(fn), "wb").close()
+            self.np.save(self._p("offsets.npy"), self.np.zeros(1, dtype=self.np.int64))
+            _write_json(self._p("ids.json"), [])
+            _write_json(self._p("ep_index.json"), {})
+            _write_json(self._p("meta.json"), {"dim": dim, "dtype": self.dtype, "n": 0})
+            self._load()
+        elif self.meta["dim"] != dim:
+            raise ValueError(f"{self.dir}: store has dim={self.meta['dim']}, got {dim}")
+
+    def _open_writer(self):
+        if self.meta is None:
+            raise RuntimeError(f"{self.dir}: call ensure(dim) before upsert()")
+        with open(self._p("ids.json")) as f:
+            ids = json.load(f)
+        eps = [None] * len(ids)
+        for ep, (a, b) in self._index.items():
+            eps[a:b] = [ep] * (b - a)
+        offsets = [int(x) for x in self._offsets]
+        # drop rows an earlier writer appended but never close()d
+        n, dim = self.meta["n"], self.meta["dim"]
+        self._release()
+        vec = open(self._p("vectors.bin"), "r+b")
+        vec.truncate(n * dim * self.np.dtype(self.meta["dtype"]).itemsize)
+        vec.seek(0, os.SEEK_END)
+        pay = open(self._p("payloads.jsonl"), "r+b")
+        pay.truncate(offsets[-1])
+        pay.seek(0, os.SEEK_END)
+        self._load()
+        self._w = {"ids": ids, "eps": eps, "offsets": offsets, "vec": vec, "pay": pay}
+
+    def upsert(self, ids, vectors, payloads):
+        np = self.np
+        if self._w is None:
+            self._open_writer()
+        w = self._w
+        v = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.meta["dim"])
+        v = v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+        if self.meta["dtype"] == "int8":
+            v = np.clip(np.rint(v * INT8_SCALE), -127, 127).astype(np.int8)
+        w["vec"].write(v.tobytes())
+        pos = w["offsets"][-1]
+        lines = []
+        for i, p in zip(ids, payloads):
+            line = json.dumps({"id": i, "payload": p}, default=str).encode("utf-8") + b"\n"
+            lines.append(line)
+            pos += len(line)
+            w["offsets"].append(pos)
+            w["ids"].append(i)
+            w["eps"].append((p or {}).get("ep_id") or "")
+        w["pay"].write(b"".join(lines))
+
+    def close(self):
+        """Finish a write session: dedupe, regroup by ep_id if needed, write the index."""
+        w, self._w = self._w, None
+        if w is None:
+            return
+        np = self.np
+        w["vec"].close(); w["pay"].close()
+        ids, eps, offsets = w["ids"], w["eps"], w["offsets"]
+        n, dim, dtype = len(ids), self.meta["dim"], self.meta["dtype"]
+
+        last = {i: r for r, i in enumerate(ids)}
+        rank = {}
+        for r in range(n):
+            if last[ids[r]] == r:
+                rank.setdefault(eps[r], len(rank))
+        order = sorted((r for r in range(n) if last[ids[r]] == r), key=lambda r: rank[eps[r]])
+
+        if order != list(range(n)):
+            self._release()
+            vecs = np.memmap(self._p("vectors.bin"), dtype=dtype, mode="r", shape=(n, dim))
+            new_off = [0]
+            with open(self._p("payloads.jsonl"), "rb") as src, \
+                    open(self._p("vectors.bin.tmp"), "wb") as vf, open(self._p("payloads.jsonl.tmp"), "wb") as pf:
+                for c in range(0, len(order), CHUNK):
+                    rows = order[c:c + CHUNK]
+                    vf.write(np.ascontiguousarray(vecs[rows]).tobytes())
+                    for r in rows:
+                        src.seek(offsets[r])
+                        line = src.read(offsets[r + 1] - offsets[r])
+                        pf.write(line)
+                        new_off.append(new_off[-1] + len(line))
+            del vecs
+            os.replace(self._p("vectors.bin.tmp"), self._p("vectors.bin"))
+            os.replace(self._p("payloads.jsonl.tmp"), self._p("payloads.jsonl"))
+            ids = [ids[r] for r in order]
+            eps = [eps[r] for r in order]
+            offsets = new_off
+
+        index = {}
+        for r, ep in enumerate(eps):
+            if ep in index:
+                index[ep][1] = r + 1
+            else:
+                index[ep] = [r, r + 1]
+        self._release()
+        np.save(self._p("offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        _write_json(self._p("ids.json"), ids)
+        _write_json(self._p("ep_index.json"), index)
+        _write_json(self._p("meta.json"), {**self.meta, "n": len(ids)})   # last: marks the store complete
+        self._load()
+
+    def _release(self):
+        if self._pay is not None:
+            self._pay.close(); self._payf.close()
+        self._vecs = self._pay = self._payf = None
+
+    # ---- reading ----
+    def _scores(self, start, stop, q):
+        sub = self._vecs[start:stop]
+        if self.meta["dtype"] == "int8":
+            return (sub.astype(self.np.float32) @ q) / INT8_SCALE
+        return sub @ q
+
+    def _row(self, r, score):
+        a, b = int(self._offsets[r]), int(self._offsets[r + 1])
+        rec = json.loads(self._pay[a:b])
+        return Hit(rec["id"], score, rec["payload"])
+
+    def search(self, vector, limit=10, ep_id=None):
+        np = self.np
+        if not len(self) or limit <= 0:
+            return []
+        q = np.asarray(vector, dtype=np.float32).ravel()
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        if ep_id is not None:
+            rng = self._index.get(ep_id)
+            if rng is None:
+                return []
+            start = rng[0]
+            scores = self._scores(rng[0], rng[1], q)
+        else:
+            start = 0
+            scores = np.concatenate([self._scores(a, min(a + CHUNK, len(self)), q)
+                                     for a in range(0, len(self), CHUNK)])
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self._row(start + int(t), float(scores[t])) for t in top]
+
+
+# ---------- factory ----------
+BACKENDS = ("qdrant", "local")
+
+
+def open_store(backend=None, name="notes_chunks_dev", url=None, path=None, dtype="float32"):
+    backend = backend or DEFAULT_BACKEND
+    if backend == "qdrant":
+        return QdrantStore(name, url)
+    if backend == "local":
+        return LocalStore(name, path, dtype)
+    raise ValueError(f"unknown vector backend {backend!r} (expected one of {', '.join(BACKENDS)})")
+
+
+def add_store_args(ap):
+    ap.add_argument("--backend", default=DEFAULT_BACKEND, choices=BACKENDS,
+                    help="Vector store: qdrant, or local (embedded mmap store, no service)")
+    ap.add_argument("--store-dir", default=DEFAULT_DIR, help="Root directory of local stores")
+    ap.add_argument("--store-dtype", default="float32", choices=("float32", "int8"),
+                    help="Row type of a new local store (int8 = 4x smaller, ~1e-2 score error)")
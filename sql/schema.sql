@@ -254,15 +254,30 @@ CREATE INDEX idx_med_patient_start ON coh.medications (patient, start);
 CREATE INDEX idx_obs_patient_date  ON coh.observations (patient, date);
 
 -- =========================
--- Episodes view (long-horizon windows using start/stop)
+-- Episodes (long-horizon windows using start/stop)
 -- =========================
-DROP MATERIALIZED VIEW IF EXISTS coh.episodes;
+-- Maintained as a table so new encounters only re-segment their own patients
+-- (see scripts/refresh_episodes.py) instead of a full REFRESH.
+CREATE TABLE coh.episodes (
+  patient  TEXT NOT NULL,
+  t0       TIMESTAMP,
+  t1       TIMESTAMP,
+  n_enc    BIGINT,
+  ep_id    TEXT PRIMARY KEY
+);
+
+CREATE INDEX idx_episodes_patient_t0_t1 ON coh.episodes (patient, t0, t1);
 
-CREATE MATERIALIZED VIEW coh.episodes AS
+-- Segmentation for a set of patients (NULL = everyone): a new episode starts
+-- when an encounter begins more than 48h after the previous one stopped.
+CREATE FUNCTION coh.segment_episodes(pats TEXT[])
+RETURNS TABLE (patient TEXT, t0 TIMESTAMP, t1 TIMESTAMP, n_enc BIGINT, ep_id TEXT)
+LANGUAGE sql STABLE AS $$
 WITH e AS (
   SELECT patient, id AS enc_id, start, stop,
          LAG(stop) OVER (PARTITION BY patient ORDER BY start) AS prev_stop
   FROM coh.encounters
+  WHERE pats IS NULL OR patient = ANY(pats)
 ),
 markers AS (
   SELECT patient, enc_id, start, stop,
@@ -281,8 +296,39 @@ SELECT patient,
        COUNT(*) AS n_enc,
        CONCAT(patient,'::',MIN(start)::date,'::',MAX(COALESCE(stop,start))::date,'::',MIN(ep_idx)) AS ep_id
 FROM grp
-GROUP BY patient, ep_idx;
+GROUP BY patient, ep_idx
+$$;
 
-CREATE INDEX idx_episodes_patient_t0_t1 ON coh.episodes (patient, t0, t1);
+-- Patients whose encounters changed since the last episode refresh.
+-- Append-only queue; the refresher consumes ids up to a high-water mark.
+CREATE TABLE coh.episodes_dirty (
+  id       BIGSERIAL PRIMARY KEY,
+  patient  TEXT NOT NULL
+);
+
+CREATE FUNCTION coh.mark_episodes_dirty() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO coh.episodes_dirty(patient)
+    SELECT DISTINCT patient FROM new_rows WHERE patient IS NOT NULL;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    INSERT INTO coh.episodes_dirty(patient)
+    SELECT DISTINCT patient FROM old_rows WHERE patient IS NOT NULL;
+  END IF;
+  RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER encounters_dirty_ins AFTER INSERT ON coh.encounters
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION coh.mark_episodes_dirty();
+CREATE TRIGGER encounters_dirty_upd AFTER UPDATE ON coh.encounters
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION coh.mark_episodes_dirty();
+CREATE TRIGGER encounters_dirty_del AFTER DELETE ON coh.encounters
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION coh.mark_episodes_dirty();
 
 COMMIT;
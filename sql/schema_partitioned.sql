@@ -0,0 +1,111 @@
+-- Optional variant of schema.sql: clinical event tables, episodes and notes
+-- hash-partitioned by patient so jobs can work one partition per worker.
+--
+--   psql -h localhost -U mimic -d synthea -v nparts=16 -f sql/schema_partitioned.sql
+--
+-- Partition k of every table is named coh.<table>_p<k> and holds the same
+-- patients (same modulus), so coh.episodes_p3 only ever joins coh.observations_p3.
+
+\ir schema.sql
+
+\if :{?nparts}
+\else
+  \set nparts 16
+\endif
+
+BEGIN;
+
+-- Replace coh.<tbl> by a hash-partitioned table with the same columns.
+CREATE FUNCTION coh.partition_by_patient(tbl TEXT, nparts INT) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+  EXECUTE format('CREATE TABLE coh.%I (LIKE coh.%I INCLUDING DEFAULTS) PARTITION BY HASH (patient)',
+                 tbl || '_new', tbl);
+  EXECUTE format('DROP TABLE coh.%I CASCADE', tbl);
+  EXECUTE format('ALTER TABLE coh.%I RENAME TO %I', tbl || '_new', tbl);
+  PERFORM coh.create_patient_partitions(tbl, nparts);
+END
+$$;
+
+CREATE FUNCTION coh.create_patient_partitions(tbl TEXT, nparts INT) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+  FOR k IN 0 .. nparts - 1 LOOP
+    EXECUTE format('CREATE TABLE coh.%I PARTITION OF coh.%I FOR VALUES WITH (MODULUS %s, REMAINDER %s)',
+                   tbl || '_p' || k, tbl, nparts, k);
+  END LOOP;
+END
+$$;
+
+SELECT coh.partition_by_patient('encounters',   :nparts);
+SELECT coh.partition_by_patient('observations', :nparts);
+SELECT coh.partition_by_patient('medications',  :nparts);
+SELECT coh.partition_by_patient('procedures',   :nparts);
+SELECT coh.partition_by_patient('episodes',     :nparts);
+
+-- Primary keys must include the partition key
+ALTER TABLE coh.encounters ADD PRIMARY KEY (patient, id);
+ALTER TABLE coh.episodes   ADD PRIMARY KEY (patient, ep_id);
+
+-- B-tree indexes keep the idx_* names so load_csv.py defers them;
+-- BRIN indexes on the time columns are tiny and cheap to maintain.
+CREATE INDEX idx_enc_patient_start       ON coh.encounters   (patient, start);
+CREATE INDEX idx_med_patient_start       ON coh.medications  (patient, start);
+CREATE INDEX idx_obs_patient_date        ON coh.observations (patient, date);
+CREATE INDEX idx_proc_patient_date       ON coh.procedures   (patient, date);
+CREATE INDEX idx_episodes_patient_t0_t1  ON coh.episodes     (patient, t0, t1);
+CREATE INDEX brin_enc_start   ON coh.encounters   USING brin (start);
+CREATE INDEX brin_med_start   ON coh.medications  USING brin (start);
+CREATE INDEX brin_obs_date    ON coh.observations USING brin (date);
+CREATE INDEX brin_proc_date   ON coh.procedures   USING brin (date);
+CREATE INDEX brin_episodes_t0 ON coh.episodes     USING brin (t0);
+
+-- The dirty-queue triggers went away with the old coh.encounters
+CREATE TRIGGER encounters_dirty_ins AFTER INSERT ON coh.encounters
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION coh.mark_episodes_dirty();
+CREATE TRIGGER encounters_dirty_upd AFTER UPDATE ON coh.encounters
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION coh.mark_episodes_dirty();
+CREATE TRIGGER encounters_dirty_del AFTER DELETE ON coh.encounters
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION coh.mark_episodes_dirty();
+
+-- Notes and episode-scoped notes (normally created by the extractor / build_note_xwalk.py;
+-- their CREATE TABLE IF NOT EXISTS leaves these partitioned tables alone)
+CREATE TABLE coh.notes (
+  id            BIGSERIAL,
+  patient       TEXT,
+  encounter     TEXT,
+  ts            TIMESTAMPTZ NULL,
+  section       TEXT,
+  text          TEXT,
+  encounter_csv TEXT
+) PARTITION BY HASH (patient);
+SELECT coh.create_patient_partitions('notes', :nparts);
+CREATE INDEX notes_idx    ON coh.notes (patient, ts);
+CREATE INDEX notes_id_idx ON coh.notes (id);
+CREATE INDEX brin_notes_ts ON coh.notes USING brin (ts);
+
+CREATE TABLE coh.episode_notes (
+  ep_id     TEXT,
+  note_id   BIGINT,
+  patient   TEXT,
+  encounter TEXT,
+  ts        TIMESTAMPTZ,
+  section   TEXT,
+  text      TEXT
+) PARTITION BY HASH (patient);
+SELECT coh.create_patient_partitions('episode_notes', :nparts);
+CREATE INDEX epn_idx         ON coh.episode_notes (ep_id, ts);
+CREATE INDEX epn_patient_idx ON coh.episode_notes (patient);
+
+-- Let the planner join / aggregate partition by partition
+DO $$
+BEGIN
+  EXECUTE format('ALTER DATABASE %I SET enable_partitionwise_join = on', current_database());
+  EXECUTE format('ALTER DATABASE %I SET enable_partitionwise_aggregate = on', current_database());
+END
+$$;
+
+COMMIT;